@@ -1,11 +1,9 @@
-import logging
 from enum import auto, StrEnum
 from typing import override
-import random
-import paho.mqtt.client as paho
 
-from device import Device, CHANCE_TO_CHANGE, GENERAL_PARAMETERS
+from device import Device, Setter
 from device_types import DeviceType
+from runtime import RuntimeContext
 
 
 class Mode(StrEnum):
@@ -32,28 +30,25 @@ DEFAULT_TEMPERATURE = 24
 MIN_TEMPERATURE = 16
 MAX_TEMPERATURE = 30
 
+# Enum values are stored as their index in these
+MODES: tuple[Mode, ...] = tuple(Mode)
+FAN_SPEEDS: tuple[FanSpeed, ...] = tuple(FanSpeed)
+SWINGS: tuple[Swing, ...] = tuple(Swing)
+
 DEFAULT_MODE = Mode.COOL
 DEFAULT_FAN = FanSpeed.MEDIUM
 DEFAULT_SWING = Swing.OFF
 
-PARAMETERS: list[str] = [
-    "temperature",
-    "mode",
-    "fan_speed",
-    "swing"
-]
-
 
 class AirConditioner(Device):
+    __slots__ = ("_temperature", "_mode", "_fan_speed", "_swing")
 
     def __init__(
             self,
             device_id: str,
             room: str,
             name: str,
-            sender_id: str,
-            mqtt_client: paho.Client,
-            logger: logging.Logger,
+            context: RuntimeContext,
             status: str = "off",
             temperature: int = DEFAULT_TEMPERATURE,
             mode: Mode = DEFAULT_MODE,
@@ -65,18 +60,16 @@ class AirConditioner(Device):
             device_type=DeviceType.AIR_CONDITIONER,
             room=room,
             name=name,
-            mqtt_client=mqtt_client,
             status=status,
-            logger=logger,
-            sender_id=sender_id
+            context=context,
         )
         if MIN_TEMPERATURE <= temperature <= MAX_TEMPERATURE:
             self._temperature: int = temperature
         else:
             raise ValueError(f"Temperature must be between {MIN_TEMPERATURE} and {MAX_TEMPERATURE}")
-        self._mode: Mode = mode
-        self._fan_speed: FanSpeed = fan_speed
-        self._swing: Swing = swing
+        self._mode: int = MODES.index(Mode(mode))
+        self._fan_speed: int = FAN_SPEEDS.index(FanSpeed(fan_speed))
+        self._swing: int = SWINGS.index(Swing(swing))
 
     @property
     def temperature(self) -> int:
@@ -91,89 +84,70 @@ class AirConditioner(Device):
 
     @property
     def mode(self) -> Mode:
-        return self._mode
+        return MODES[self._mode]
 
     @mode.setter
     def mode(self, value: Mode) -> None:
-        self._mode = value
+        self._mode = MODES.index(Mode(value))
 
     @property
     def fan_speed(self) -> FanSpeed:
-        return self._fan_speed
+        return FAN_SPEEDS[self._fan_speed]
 
     @fan_speed.setter
     def fan_speed(self, value: FanSpeed) -> None:
-        self._fan_speed = value
+        self._fan_speed = FAN_SPEEDS.index(FanSpeed(value))
 
     @property
     def swing(self) -> Swing:
-        return self._swing
+        return SWINGS[self._swing]
 
     @swing.setter
     def swing(self, value: Swing) -> None:
-        self._swing = value
+        self._swing = SWINGS.index(Swing(value))
+
+    SETTERS: dict[str, Setter] = {
+        **Device.SETTERS,
+        "temperature": (temperature.fset, None),
+        "mode": (mode.fset, Mode),
+        "fan_speed": (fan_speed.fset, FanSpeed),
+        "swing": (swing.fset, Swing),
+    }
 
     @override
-    def tick(self) -> None:
-        """
-        Actions to perform on every iteration of the main loop.
-        - Randomly apply change
-        - Publish changes to MQTT
-        """
-        action_parameters = {}
-        update_parameters = {}
-        random.seed()
-        if random.random() < CHANCE_TO_CHANGE:
-            element_to_change = random.choice(['status', 'temperature', 'mode', 'fan_speed', 'swing'])
-            match element_to_change:
-                case 'status':
-                    update_parameters['status'] = self.status = 'on' if self.status == 'off' else 'off'
-                case 'temperature':
-                    next_temperature = self.temperature
-                    while next_temperature == self.temperature:
-                        next_temperature = random.randint(MIN_TEMPERATURE, MAX_TEMPERATURE)
-                    action_parameters['temperature'] = self.temperature = next_temperature
-                case 'mode':
-                    next_mode = self.mode
-                    while next_mode == self.mode:
-                        next_mode = random.choice(list(Mode))
-                    action_parameters['mode'] = self.mode = next_mode
-                case 'fan_speed':
-                    next_speed = self.fan_speed
-                    while next_speed == self.fan_speed:
-                        next_speed = random.choice(list(FanSpeed))
-                    action_parameters['fan_speed'] = self.fan_speed = next_speed
-                case 'swing':
-                    next_swing = self.swing
-                    while next_swing == self.swing:
-                        next_swing = random.choice(list(Swing))
-                    action_parameters['swing'] = self.swing = next_swing
-                case _:
-                    print(f"Unknown element {element_to_change}")
-        self.publish_mqtt(action_parameters, update_parameters)
+    def parameters(self) -> dict:
+        return {
+            "temperature": self.temperature,
+            "mode": self.mode.value,
+            "fan_speed": self.fan_speed.value,
+            "swing": self.swing.value,
+        }
 
     @override
-    def update(self, new_values: dict) -> None:
-        for key, value in new_values.items():
-            if key in PARAMETERS + GENERAL_PARAMETERS:
-                try:
-                    match key:
-                        case "room":
-                            self.room = value
-                        case "name":
-                            self.name = value
-                        case "status":
-                            self.status = value
-                        case "temperature":
-                            self.temperature = value
-                        case "mode":
-                            self.mode = Mode(value=value)
-                        case "fan_speed":
-                            self.fan_speed = FanSpeed(value=value)
-                        case "swing":
-                            self.swing = Swing(value=value)
-                    self._logger.info(f"Setting parameter '{key}' to value '{value}'")
-                except ValueError:
-                    self._logger.exception(f"Incorrect value {value} for parameter {key}")
-            else:
-                raise ValueError(f"Incorrect parameter {key} for device type {self.type.value}")
+    def random_change(self, action_parameters: dict, update_parameters: dict) -> None:
+        element_to_change = self.choice(['status', 'temperature', 'mode', 'fan_speed', 'swing'])
+        match element_to_change:
+            case 'status':
+                update_parameters['status'] = self.status = 'on' if self.status == 'off' else 'off'
+            case 'temperature':
+                next_temperature = self.temperature
+                while next_temperature == self.temperature:
+                    next_temperature = self.randint(MIN_TEMPERATURE, MAX_TEMPERATURE)
+                action_parameters['temperature'] = self.temperature = next_temperature
+            case 'mode':
+                next_mode = self.mode
+                while next_mode == self.mode:
+                    next_mode = self.choice(MODES)
+                action_parameters['mode'] = self.mode = next_mode
+            case 'fan_speed':
+                next_speed = self.fan_speed
+                while next_speed == self.fan_speed:
+                    next_speed = self.choice(FAN_SPEEDS)
+                action_parameters['fan_speed'] = self.fan_speed = next_speed
+            case 'swing':
+                next_swing = self.swing
+                while next_swing == self.swing:
+                    next_swing = self.choice(SWINGS)
+                action_parameters['swing'] = self.swing = next_swing
+            case _:
+                print(f"Unknown element {element_to_change}")
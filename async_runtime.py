@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import socket
+
+import paho.mqtt.client as paho
+
+MAX_RECONNECT_DELAY = 60
+
+
+class AsyncioHelper:
+    """
+    Drives a paho client from an asyncio event loop through its socket callbacks, instead of paho's own
+    network thread, so MQTT callbacks run on the same thread as everything else on the loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: paho.Client, logger: logging.Logger):
+        self._loop = loop
+        self._client = client
+        self._logger = logger
+        self._misc: asyncio.Task | None = None
+        self._reconnect: asyncio.Task | None = None
+        self._closing = False
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    async def connect(self, host: str, port: int, keepalive: int) -> None:
+        """
+        Connects to the broker, retrying with exponential backoff until it succeeds.
+        """
+        delay = 1
+        while True:
+            try:
+                self._client.connect(host, port, keepalive)
+                return
+            except OSError:
+                self._logger.error(f"Failed to connect to broker. Retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def disconnect(self) -> None:
+        self._closing = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        self._client.disconnect()
+        # Flush the DISCONNECT packet now, the loop may not get another chance to
+        self._client.loop_write()
+
+    def _on_socket_open(self, client: paho.Client, _userdata, sock: socket.socket) -> None:
+        self._loop.add_reader(sock, client.loop_read)
+        if self._misc is None:
+            self._misc = self._loop.create_task(self._loop_misc())
+
+    def _on_socket_close(self, _client: paho.Client, _userdata, sock: socket.socket) -> None:
+        self._loop.remove_reader(sock)
+        if not self._closing and self._reconnect is None:
+            self._reconnect = self._loop.create_task(self._reconnect_with_backoff())
+
+    def _on_socket_register_write(self, client: paho.Client, _userdata, sock: socket.socket) -> None:
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, _client: paho.Client, _userdata, sock: socket.socket) -> None:
+        self._loop.remove_writer(sock)
+
+    async def _loop_misc(self) -> None:
+        # Keepalive pings and retries, stops once the connection is lost
+        while self._client.loop_misc() == paho.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+        self._misc = None
+
+    async def _reconnect_with_backoff(self) -> None:
+        delay = 1
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                self._client.reconnect()
+                break
+            except OSError:
+                self._logger.error(f"Failed to reconnect to broker. Retrying in {delay * 2} seconds...")
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        self._reconnect = None
@@ -0,0 +1,150 @@
+"""
+Fixtures shared by the benchmarks.
+
+Messages are published to an in-process fake client by default, pass --broker host[:port] to publish to a real
+broker instead, e.g. mosquitto started with:
+
+    docker run --rm -p 1883:1883 eclipse-mosquitto mosquitto -c /mosquitto-no-auth.conf
+"""
+import json
+import os
+import sys
+import time
+
+import paho.mqtt.client as paho
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Runs are reproducible, use simulated time that only moves when a benchmark advances it, and never touch the
+# snapshot file. Set before main reads them on import
+os.environ.setdefault("SIM_SEED", "0")
+os.environ.setdefault("SIM_SPEED", "max")
+os.environ.setdefault("SIM_START", "2025-01-01T06:00")
+os.environ["SNAPSHOT_PATH"] = ""
+os.environ.pop("SINK_PATH", None)
+os.environ.pop("GENERATOR_HOMES", None)
+
+import main  # noqa: E402
+from device_registry import DeviceRegistry  # noqa: E402
+from generator import HomeGenerator  # noqa: E402
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data.json")
+FLEET_SIZES = "1000,10000,100000"
+
+
+class FakeClient:
+    """
+    Stands in for paho.Client, accepting every publish without any networking.
+    """
+
+    def __init__(self):
+        self.on_publish = None
+        self.published = 0
+        self.published_bytes = 0
+        self._mid = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None) -> paho.MQTTMessageInfo:
+        self._mid += 1
+        self.published += 1
+        self.published_bytes += len(payload) if payload else 0
+        info = paho.MQTTMessageInfo(self._mid)
+        info.rc = paho.MQTT_ERR_SUCCESS
+        # Acknowledged right away, reported before the message is marked as published like paho does
+        if self.on_publish is not None:
+            self.on_publish(self, None, self._mid, None, None)
+        info._set_as_published()
+        return info
+
+    def is_connected(self) -> bool:
+        return True
+
+    def subscribe(self, topic, qos=0, options=None, properties=None) -> tuple[int, int]:
+        self._mid += 1
+        return paho.MQTT_ERR_SUCCESS, self._mid
+
+    def unsubscribe(self, topic, properties=None) -> tuple[int, int]:
+        self._mid += 1
+        return paho.MQTT_ERR_SUCCESS, self._mid
+
+    def loop_stop(self) -> int:
+        return paho.MQTT_ERR_SUCCESS
+
+    def disconnect(self, reasoncode=None, properties=None) -> int:
+        return paho.MQTT_ERR_SUCCESS
+
+
+def pytest_addoption(parser):
+    parser.addoption("--broker", default=None, help="host[:port] of a broker to publish to instead of a fake client")
+    parser.addoption(
+        "--fleet-sizes", default=FLEET_SIZES, help=f"comma separated device counts, default {FLEET_SIZES}"
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "fleet_size" in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption("--fleet-sizes").split(",")]
+        metafunc.parametrize("fleet_size", sizes, scope="module")
+
+
+@pytest.fixture(scope="session")
+def templates() -> list[dict]:
+    with open(DATA_PATH) as file:
+        return json.load(file)
+
+
+@pytest.fixture(scope="session")
+def client(request):
+    broker = request.config.getoption("--broker")
+    if broker is None:
+        yield FakeClient()
+        return
+    host, _, port = broker.partition(":")
+    real_client = main.create_mqtt_client(f"simulator-benchmark-{os.getpid()}")
+    # Each benchmark builds its own pool around the client, which is told about the connection then
+    real_client.on_connect = None
+    real_client.connect(host, int(port or 1883), 60)
+    real_client.loop_start()
+    while not real_client.is_connected():
+        time.sleep(0.01)
+    yield real_client
+    real_client.loop_stop()
+    real_client.disconnect()
+
+
+@pytest.fixture
+def simulator(client):
+    """
+    The main module with an empty fleet, publishing to the benchmark's client.
+    """
+    main.devices = DeviceRegistry(slices=main.TICK_SLICES)
+    main.routes = main.create_routes()
+    main.pool = main.create_pool([client])
+    main.context = main.create_context()
+    if client.is_connected():
+        main.pool.on_connect(client)
+    main.engine = main.create_engine()
+    return main
+
+
+def fleet(templates: list[dict], size: int) -> list[dict]:
+    """
+    Device data of at least size devices, in homes generated from the templates.
+    """
+    homes = -(-size // len(templates))
+    return list(HomeGenerator(templates, homes, main.simulation_random))[:size]
+
+
+@pytest.fixture(scope="module")
+def fleet_data(templates, fleet_size) -> list[dict]:
+    return fleet(templates, fleet_size)
+
+
+@pytest.fixture
+def populated(simulator, fleet_data):
+    """
+    The main module simulating a fleet of fleet_size devices.
+    """
+    for device_data in fleet_data:
+        simulator.create_device(device_data, quiet=True)
+    return simulator
@@ -0,0 +1,102 @@
+"""
+Measures how many bytes each simulated device takes, per device type.
+
+    python benchmarks/device_memory.py [--count N] [--json] [--baseline results.json]
+
+Devices are built from the templates in data.json, and everything they retain is counted with tracemalloc,
+including their ids and parameter values.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tracemalloc
+from datetime import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from air_conditioner import AirConditioner  # noqa: E402
+from curtain import Curtain  # noqa: E402
+from door_lock import DoorLock  # noqa: E402
+from light import Light  # noqa: E402
+from runtime import RuntimeContext  # noqa: E402
+from water_heater import WaterHeater  # noqa: E402
+
+CLASSES = {
+    "air_conditioner": AirConditioner,
+    "curtain": Curtain,
+    "door_lock": DoorLock,
+    "light": Light,
+    "water_heater": WaterHeater,
+}
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data.json")
+
+
+def build(template: dict, index: int, context: RuntimeContext):
+    parameters = dict(template.get("parameters", {}))
+    # Reported, but follows from the other parameters
+    parameters.pop("is_heating", None)
+    for key in ("scheduled_on", "scheduled_off"):
+        if key in parameters:
+            parameters[key] = time.fromisoformat(WaterHeater.fix_time_string(parameters[key]))
+    return CLASSES[template["type"]](
+        device_id=f"{template['id']}-{index}",
+        room=template["room"],
+        name=template["name"],
+        status=template["status"],
+        context=context,
+        **parameters,
+    )
+
+
+def measure(template: dict, count: int, context: RuntimeContext) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    devices = [build(template, index, context) for index in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The list holding them isn't part of a device
+    return (after - before - sys.getsizeof(devices)) / len(devices)
+
+
+def positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got {value!r}") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=positive_int, default=10_000, help="devices to create per type")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with open(DATA_PATH) as file:
+        templates = {}
+        for device_data in json.load(file):
+            templates.setdefault(device_data["type"], device_data)
+    context = RuntimeContext(mqtt_client=None, logger=logging.getLogger(__name__), sender_id="benchmark")
+    results = {device_type: measure(template, args.count, context) for device_type, template in templates.items()}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    for device_type, size in results.items():
+        line = f"{device_type:<16} {size:8.1f} bytes/device"
+        if device_type in baseline:
+            line += f"  (was {baseline[device_type]:.1f}, {size / baseline[device_type] - 1:+.0%})"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
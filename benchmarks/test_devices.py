@@ -0,0 +1,46 @@
+"""
+Per-device hot paths: tick() of every device type, and publishing through Device.publish_mqtt.
+"""
+import pytest
+
+from device_types import DeviceType
+
+TICKS_PER_ROUND = 1000
+
+
+@pytest.fixture
+def devices_by_type(simulator, templates) -> dict[str, list]:
+    for template in templates:
+        simulator.create_device(template, quiet=True)
+    by_type: dict[str, list] = {}
+    for device in simulator.devices:
+        by_type.setdefault(device.type.value, []).append(device)
+    return by_type
+
+
+@pytest.mark.parametrize("device_type", [device_type.value for device_type in DeviceType])
+def test_tick(benchmark, simulator, devices_by_type, device_type):
+    """
+    TICKS_PER_ROUND ticks of one device, including its random changes and publishes.
+    """
+    device = devices_by_type[device_type][0]
+    clock = simulator.simulation_clock
+
+    def run() -> None:
+        for _ in range(TICKS_PER_ROUND):
+            clock.advance(simulator.TICK_INTERVAL)
+            device.tick()
+
+    benchmark(run)
+    benchmark.extra_info["ticks_per_round"] = TICKS_PER_ROUND
+
+
+@pytest.mark.parametrize("filtered", [False, True], ids=["unfiltered", "filtered"])
+def test_publish_mqtt(benchmark, simulator, devices_by_type, filtered):
+    """
+    Publishing an action and an update, with the publish filter dropping repeated values or disabled.
+    """
+    device = devices_by_type[DeviceType.LIGHT.value][0]
+    if not filtered:
+        simulator.context.publish_filter = None
+    benchmark(device.publish_mqtt, {"brightness": 40}, {"status": "on"})
@@ -0,0 +1,92 @@
+"""
+Paths whose cost grows with the fleet: creating devices, dispatching incoming messages, and a full main loop
+iteration. Fleet sizes are set with --fleet-sizes.
+"""
+import json
+
+import paho.mqtt.client as paho
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+
+from device_registry import DeviceRegistry
+
+MESSAGES_PER_ROUND = 1000
+
+
+def test_create_devices(benchmark, simulator, fleet_data, fleet_size):
+    def setup() -> None:
+        simulator.devices = DeviceRegistry(slices=simulator.TICK_SLICES)
+        simulator.routes = simulator.create_routes()
+        simulator.engine = simulator.create_engine()
+
+    def run() -> None:
+        for device_data in fleet_data:
+            simulator.create_device(device_data, quiet=True)
+
+    benchmark.pedantic(run, setup=setup, rounds=3)
+    assert len(simulator.devices) == fleet_size
+
+
+def incoming_messages(fleet_data: list[dict]) -> list[paho.MQTTMessage]:
+    """
+    Updates sent to devices spread over the whole fleet, as another instance would send them.
+    """
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.UserProperty = [("sender_id", "another-simulator")]
+    step = max(1, len(fleet_data) // MESSAGES_PER_ROUND)
+    messages = []
+    for device_data in fleet_data[::step][:MESSAGES_PER_ROUND]:
+        message = paho.MQTTMessage(topic=f"project/home/{device_data['id']}/update".encode())
+        message.payload = json.dumps({"name": f"{device_data['name']} renamed"}).encode()
+        message.properties = properties
+        messages.append(message)
+    return messages
+
+
+def test_on_message(benchmark, populated, fleet_data):
+    """
+    MESSAGES_PER_ROUND incoming updates, from decoding to applying them to their devices.
+    """
+    messages = incoming_messages(fleet_data)
+
+    def run() -> None:
+        for message in messages:
+            populated.on_message(populated.pool.clients[0], None, message)
+
+    benchmark(run)
+    benchmark.extra_info["messages_per_round"] = len(messages)
+
+
+def test_on_message_self_echo(benchmark, populated, fleet_data):
+    """
+    MESSAGES_PER_ROUND of this instance's own messages, which are dropped.
+    """
+    messages = incoming_messages(fleet_data)
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.UserProperty = [("sender_id", populated.client_id)]
+    for message in messages:
+        message.properties = properties
+
+    def run() -> None:
+        for message in messages:
+            populated.on_message(populated.pool.clients[0], None, message)
+
+    benchmark(run)
+    benchmark.extra_info["messages_per_round"] = len(messages)
+
+
+def test_main_loop(benchmark, populated, fleet_size):
+    """
+    One iteration of the main loop over every slice, with simulated time moving forward by TICK_INTERVAL.
+    """
+    clock = populated.simulation_clock
+
+    def run() -> None:
+        clock.advance(populated.TICK_INTERVAL)
+        for slice_index in range(populated.TICK_SLICES):
+            populated.tick(slice_index)
+
+    # The first iteration publishes every device's initial state, it isn't part of the steady state
+    run()
+    benchmark.pedantic(run, rounds=5 if fleet_size >= 100000 else 20)
+    benchmark.extra_info["devices"] = fleet_size
@@ -0,0 +1,159 @@
+import codecs
+import json
+import logging
+import random
+import resource
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+import requests
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl")
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Yields the items of a JSON array as its bytes arrive, without holding the whole document in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE + ("," if started else ""):
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item is split across chunks
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                # A number or literal at the end of the buffer may continue in the next chunk
+                break
+            yield item
+            position = end
+    raise ValueError("Unexpected end of JSON array")
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class DeviceLoader:
+    """
+    Streams the device list from the backend, handing each device to a callback as soon as it's parsed.
+    Supports NDJSON responses, plain JSON arrays (parsed incrementally), and pagination through Link headers,
+    all over a single keep-alive session.
+    """
+
+    def __init__(
+            self,
+            api_url: str,
+            logger: logging.Logger,
+            retries: int,
+            page_size: int | None = None,
+            session: requests.Session | None = None,
+    ):
+        self._url = api_url + '/api/devices'
+        self._logger = logger
+        self._retries = retries
+        self._page_size = page_size
+        self._session = session if session is not None else requests.Session()
+        self._session.headers["Accept"] = ", ".join(NDJSON_TYPES) + ", application/json;q=0.9"
+        # Outcome of the last load
+        self.etag: str | None = None
+        self.not_modified = False
+        self.complete = False
+
+    def load(self, on_device: Callable[[dict], None], etag: str | None = None) -> int:
+        """
+        Loads every device, retrying each page with exponential backoff. A retried page is delivered again
+        from its start, so on_device may see a device more than once.
+        If an etag is given and the backend reports the list hasn't changed since, nothing is loaded and
+        not_modified is set.
+        Returns the number of devices received, which is 0 if every attempt failed.
+        """
+        start = time.perf_counter()
+        received = 0
+        self.not_modified = False
+        self.complete = False
+
+        def handle(device_data: dict) -> None:
+            nonlocal received
+            received += 1
+            on_device(device_data)
+
+        url: str | None = self._url
+        params = {"page_size": self._page_size} if self._page_size else None
+        first_page = True
+        while url is not None:
+            for attempt in range(self._retries):
+                try:
+                    url = self._load_page(url, params, etag if first_page else None, first_page, handle)
+                    break
+                except requests.exceptions.RequestException as e:
+                    self._logger.error(f"Failed to get devices: {e}")
+                except ValueError:
+                    self._logger.exception("Failed to parse devices")
+                delay = 2 ** attempt + random.random()
+                self._logger.error(f"Attempt {attempt + 1}/{self._retries} failed. Retrying in {delay:.2f} seconds...")
+                time.sleep(delay)
+            else:
+                break
+            # The next page URL already carries the query parameters
+            params = None
+            first_page = False
+        else:
+            self.complete = True
+        self._logger.info(
+            f"Received {received} devices in {time.perf_counter() - start:.2f}s, peak RSS {peak_rss_mib():.1f} MiB"
+        )
+        return received
+
+    def _load_page(
+            self,
+            url: str,
+            params: dict | None,
+            etag: str | None,
+            first_page: bool,
+            on_device: Callable[[dict], None],
+    ) -> str | None:
+        """
+        Loads a single page, and returns the URL of the next page if there is one.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        with self._session.get(url, params=params, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                self.not_modified = True
+                self.etag = etag
+                return None
+            if first_page:
+                # The first page's ETag identifies the version of the whole list
+                self.etag = response.headers.get("ETag")
+            if not 200 <= response.status_code < 400:
+                raise requests.exceptions.HTTPError(f"{response.status_code} {response.text}", response=response)
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            if content_type in NDJSON_TYPES:
+                items = (json.loads(line) for line in response.iter_lines() if line.strip())
+            else:
+                items = iter_json_array(response.iter_content(chunk_size=CHUNK_SIZE))
+            for device_data in items:
+                on_device(device_data)
+            return response.links.get("next", {}).get("url")
@@ -0,0 +1,186 @@
+import logging
+import time
+import zlib
+from typing import Any, Callable
+
+import paho.mqtt.client as paho
+
+from metrics import CountingPublisher, Metrics
+from outbound import OutboundQueue
+from subscriptions import CONTROL_TOPIC, SubscriptionManager, TOPIC_PREFIX
+
+DEVICE_TOPIC_START = len(TOPIC_PREFIX) + 1
+
+
+class Connection:
+    """
+    One client of the pool, with the subscriptions of the devices mapped to it and its own outbound buffer.
+    """
+
+    def __init__(
+            self,
+            index: int,
+            client: paho.Client,
+            subscriptions: SubscriptionManager,
+            publisher: Any,
+            outbound: OutboundQueue | None,
+    ):
+        self.index = index
+        self.client = client
+        self.subscriptions = subscriptions
+        self.publisher = publisher
+        self.outbound = outbound
+        # Stats
+        self.connected = False
+        self.connects = 0
+        self.disconnects = 0
+        self.published = 0
+        self.last_change = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "published": self.published,
+            "seconds_in_state": time.monotonic() - self.last_change,
+            "outbound_depth": self.outbound.depth if self.outbound is not None else 0,
+            # paho has no public API for its queues
+            "inflight": getattr(self.client, "_inflight_messages", 0),
+            "queued_messages": len(getattr(self.client, "_out_messages", ())),
+            "queued_packets": len(getattr(self.client, "_out_packet", ())),
+        }
+
+
+class ClientPool:
+    """
+    Spreads publishing and subscriptions over several MQTT connections, each with its own network loop.
+    Every device is mapped to one connection by a hash of its id, so its messages keep their order, and the
+    connection that publishes a device's messages is also the one subscribed to its topics.
+    The first connection also subscribes to the control topics, so new device posts are received once.
+    """
+
+    def __init__(
+            self,
+            clients: list[paho.Client],
+            logger: logging.Logger,
+            metrics: Metrics,
+            per_device: bool = True,
+            outbound: Callable[[Any], OutboundQueue] | None = None,
+            control_topics: tuple[str, ...] = (CONTROL_TOPIC,),
+    ):
+        if not clients:
+            raise ValueError("A client pool needs at least one client")
+        self._logger = logger
+        self.connections: list[Connection] = []
+        self._by_client: dict[int, Connection] = {}
+        for index, client in enumerate(clients):
+            subscriptions = SubscriptionManager(
+                client, logger, per_device=per_device, control=index == 0, control_topics=control_topics
+            )
+            publisher = CountingPublisher(client, metrics)
+            queue = outbound(publisher) if outbound is not None else None
+            if queue is not None:
+                client.on_publish = queue.on_publish
+            connection = Connection(index, client, subscriptions, queue if queue is not None else publisher, queue)
+            self.connections.append(connection)
+            self._by_client[id(client)] = connection
+
+    @property
+    def clients(self) -> list[paho.Client]:
+        return [connection.client for connection in self.connections]
+
+    def connection_of(self, device_id: str) -> Connection:
+        if len(self.connections) == 1:
+            return self.connections[0]
+        return self.connections[zlib.crc32(device_id.encode()) % len(self.connections)]
+
+    def connection_for(self, client: paho.Client) -> Connection:
+        return self._by_client[id(client)]
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False, properties: Any = None):
+        if len(self.connections) == 1:
+            connection = self.connections[0]
+        elif topic.startswith(TOPIC_PREFIX):
+            connection = self.connection_of(topic[DEVICE_TOPIC_START:topic.rfind("/")])
+        else:
+            # Batches aren't tied to a single device, any connection will do as long as it's always the same one
+            connection = self.connection_of(topic)
+        connection.published += 1
+        return connection.publisher.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+
+    # Subscriptions
+
+    def add_device(self, device_id: str) -> None:
+        self.connection_of(device_id).subscriptions.add_device(device_id)
+
+    def remove_device(self, device_id: str) -> None:
+        self.connection_of(device_id).subscriptions.remove_device(device_id)
+
+    def flush(self) -> None:
+        for connection in self.connections:
+            connection.subscriptions.flush()
+
+    # Outbound buffers
+
+    @property
+    def paused(self) -> bool:
+        return any(connection.outbound.paused for connection in self.connections if connection.outbound is not None)
+
+    @property
+    def depth(self) -> int:
+        return sum(connection.outbound.depth for connection in self.connections if connection.outbound is not None)
+
+    @property
+    def dropped(self) -> int:
+        return sum(connection.outbound.dropped for connection in self.connections if connection.outbound is not None)
+
+    @property
+    def coalesced(self) -> int:
+        return sum(
+            connection.outbound.coalesced for connection in self.connections if connection.outbound is not None
+        )
+
+    def drain(self) -> None:
+        for connection in self.connections:
+            if connection.outbound is not None:
+                connection.outbound.drain()
+
+    # Connection lifecycle
+
+    def on_connect(self, client: paho.Client) -> None:
+        connection = self.connection_for(client)
+        connection.connected = True
+        connection.connects += 1
+        connection.last_change = time.monotonic()
+        connection.subscriptions.on_connect()
+        if connection.outbound is not None:
+            connection.outbound.on_connect()
+
+    def on_disconnect(self, client: paho.Client) -> None:
+        connection = self.connection_for(client)
+        connection.connected = False
+        connection.disconnects += 1
+        connection.last_change = time.monotonic()
+        connection.subscriptions.on_disconnect()
+        if connection.outbound is not None:
+            connection.outbound.on_disconnect()
+
+    def connect_async(self, host: str, port: int, keepalive: int) -> None:
+        for client in self.clients:
+            client.connect_async(host, port, keepalive)
+
+    def loop_start(self) -> None:
+        for client in self.clients:
+            client.loop_start()
+
+    def loop_stop(self) -> None:
+        for client in self.clients:
+            client.loop_stop()
+
+    def disconnect(self) -> None:
+        for client in self.clients:
+            client.disconnect()
+
+    def stats(self) -> dict[int, dict]:
+        return {connection.index: connection.stats() for connection in self.connections}
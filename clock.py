@@ -0,0 +1,48 @@
+import asyncio
+import time
+from typing import Callable
+
+
+class SimulationClock:
+    """
+    Simulated time, in seconds since the epoch, shared by every device.
+    Starts at the given time, or the wall clock time, and runs speed times faster than the wall clock.
+    With no speed, the clock runs as fast as possible: it stands still until advanced, and sleeping on it
+    advances it instead of waiting.
+    """
+
+    def __init__(
+            self,
+            speed: float | None = 1.0,
+            start: float | None = None,
+            wall: Callable[[], float] = time.time,
+    ):
+        if speed is not None and speed <= 0:
+            raise ValueError(f"Clock speed must be positive, got {speed} instead.")
+        self.speed = speed
+        self._wall = wall
+        self._wall_start = wall()
+        self._start = start if start is not None else self._wall_start
+        self._time = self._start
+
+    def now(self) -> float:
+        if self.speed is None:
+            return self._time
+        return self._start + (self._wall() - self._wall_start) * self.speed
+
+    @property
+    def elapsed(self) -> float:
+        return self.now() - self._start
+
+    def advance(self, seconds: float) -> None:
+        if self.speed is not None:
+            raise RuntimeError("Only a clock running as fast as possible can be advanced")
+        self._time += max(0.0, seconds)
+
+    def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+
+    async def sleep_async(self, seconds: float) -> None:
+        self.advance(seconds)
+        # Still yield, so the event loop can handle messages between ticks
+        await asyncio.sleep(0)
@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+import paho.mqtt.client as paho
+
+from serialization import Codec
+from sharding import HashRing
+from subscriptions import CONTROL_TOPIC
+
+CLUSTER_PREFIX = "project/simulator"
+# Heartbeats a member can miss before the others drop it and take over its devices
+EXPIRY_HEARTBEATS = 3
+
+
+def check_name(kind: str, name: str) -> None:
+    if not name or any(char in name for char in "+#/"):
+        raise ValueError(f"Cluster {kind} {name!r} can't be empty or contain topic wildcards or separators")
+
+
+def cluster_topics(group: str, member_id: str) -> tuple[str, ...]:
+    """
+    Topics a member subscribes to instead of the control topic: new device posts as a shared subscription, so the
+    broker delivers each post to one member of the group, the group's membership topic and the member's inbox.
+    """
+    check_name("group", group)
+    check_name("member", member_id)
+    prefix = f"{CLUSTER_PREFIX}/{group}"
+    return f"$share/{group}/{CONTROL_TOPIC}", f"{prefix}/members", f"{prefix}/{member_id}/post"
+
+
+class Cluster:
+    """
+    Splits the devices between the simulator replicas of a group, by consistent hashing of their id over the live
+    members, so each replica simulates and subscribes to its own share.
+    Members announce themselves with heartbeats on the group's membership topic. One that says it's leaving, or
+    isn't heard from for EXPIRY_HEARTBEATS heartbeats, is dropped and its devices move to the others.
+    A member that receives a post for a device it doesn't own forwards it to the owner's inbox, along with its own id.
+    Forwarded posts are never forwarded again, so they can't bounce between members whose views of the membership
+    differ: the receiver creates the device, and the views settle with the next heartbeats.
+    """
+
+    def __init__(
+            self,
+            client: paho.Client,
+            group: str,
+            member_id: str,
+            codec: Codec,
+            properties: Any,
+            logger: logging.Logger,
+            heartbeat: float = 5.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        if heartbeat <= 0:
+            raise ValueError(f"Heartbeat interval must be positive, got {heartbeat} instead.")
+        _, self._members_topic, _ = cluster_topics(group, member_id)
+        self.client = client
+        self.group = group
+        self.member_id = member_id
+        self.prefix = f"{CLUSTER_PREFIX}/{group}/"
+        self._codec = codec
+        self._properties = properties
+        self._logger = logger
+        self.heartbeat = heartbeat
+        self._clock = clock
+        # When each other member was last heard from
+        self._seen: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._next_heartbeat = 0.0
+        self.members = [member_id]
+        self._ring = HashRing(self.members)
+
+    def owner(self, device_id: str) -> str:
+        return self._ring.owner(device_id)
+
+    def owns(self, device_id: str) -> bool:
+        return self._ring.owner(device_id) == self.member_id
+
+    def forward(self, device_data: dict) -> None:
+        owner = self.owner(device_data["id"])
+        self._logger.info(f"Forwarding device {device_data['id']} to {owner}")
+        payload = self._codec.encode({"from": self.member_id, "device": device_data})
+        self.client.publish(f"{self.prefix}{owner}/post", payload, qos=1, properties=self._properties)
+
+    def on_connect(self) -> None:
+        # Members that hear of a new member answer at once, so it learns the membership without waiting a heartbeat
+        self._publish("join")
+
+    def on_message(self, topic: str, message: dict) -> dict | None:
+        """
+        Handles a message on one of the cluster's topics. Returns the device data of a forwarded post, which is
+        to be created here whoever owns it.
+        """
+        if topic != self._members_topic:
+            device_data = message.get("device")
+            if not isinstance(device_data, dict) or "id" not in device_data:
+                raise ValueError(f"Forwarded post from {message.get('from')} has no device data")
+            device_id = device_data["id"]
+            if not self.owns(device_id):
+                self._logger.warning(
+                    f"{message.get('from')} forwarded device {device_id}, which {self.owner(device_id)} owns as far "
+                    f"as this member knows, creating it here instead of forwarding it again"
+                )
+            return device_data
+        member, state = message.get("member"), message.get("state")
+        if not isinstance(member, str) or member == self.member_id:
+            return None
+        with self._lock:
+            if state == "leave":
+                self._seen.pop(member, None)
+                return None
+            is_new = member not in self._seen
+            self._seen[member] = self._clock()
+        if is_new and state == "join":
+            self._next_heartbeat = 0.0
+        return None
+
+    def poll(self) -> tuple[list[str], list[str]] | None:
+        """
+        Sends a heartbeat when one is due and drops members that stopped sending theirs.
+        When the membership changed, which moves devices between members, returns the members that joined and left.
+        """
+        now = self._clock()
+        if now >= self._next_heartbeat:
+            self._publish("alive")
+        expiry = self.heartbeat * EXPIRY_HEARTBEATS
+        with self._lock:
+            for member in [member for member, seen in self._seen.items() if now - seen > expiry]:
+                del self._seen[member]
+                self._logger.warning(f"Cluster member {member} stopped sending heartbeats")
+            members = sorted({self.member_id, *self._seen})
+        if members == self.members:
+            return None
+        joined = [member for member in members if member not in self.members]
+        left = [member for member in self.members if member not in members]
+        self.members = members
+        self._ring = HashRing(members)
+        self._logger.info(f"Cluster group {self.group} has {len(members)} members: {', '.join(members)}")
+        return joined, left
+
+    def leave(self, timeout: float = 1.0) -> None:
+        info = self._publish("leave", qos=1)
+        try:
+            info.wait_for_publish(timeout)
+        except (RuntimeError, ValueError):
+            # Not connected, the others will drop this member once its heartbeats stop
+            pass
+
+    def _publish(self, state: str, qos: int = 0) -> paho.MQTTMessageInfo:
+        self._next_heartbeat = self._clock() + self.heartbeat
+        payload = self._codec.encode({"member": self.member_id, "state": state})
+        return self.client.publish(self._members_topic, payload, qos=qos, properties=self._properties)
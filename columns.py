@@ -0,0 +1,53 @@
+class Column:
+    """
+    A device attribute that can be moved into a column of a structure-of-arrays store.
+    While the device is not attached to a store the value lives in the instance's slot as usual,
+    once attached the device becomes a thin view over its row in the store's arrays.
+    Values are plain numbers, so they can be stored in the arrays as they are.
+    """
+
+    def __init__(self, dtype: type):
+        self.dtype = dtype
+        self.name = ""
+        # The member descriptor of the slot this column replaces
+        self.slot = None
+
+    def install(self, owner: type, name: str) -> None:
+        """
+        Puts the column in place of the slot of the same name on a device class.
+        """
+        for klass in owner.__mro__:
+            if name in vars(klass):
+                self.slot = vars(klass)[name]
+                break
+        else:
+            raise AttributeError(f"{owner.__name__} has no slot named {name}")
+        self.name = name
+        setattr(owner, name, self)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        store = instance._store
+        if store is None:
+            return self.slot.__get__(instance, owner)
+        return self.dtype(store.columns[self.name][instance._row])
+
+    def __set__(self, instance, value) -> None:
+        store = instance._store
+        if store is None:
+            self.slot.__set__(instance, value)
+        else:
+            store.columns[self.name][instance._row] = value
+
+
+def columns_of(device_class: type) -> dict[str, Column]:
+    """
+    Returns every Column declared on a device class or its bases.
+    """
+    found = {}
+    for klass in reversed(device_class.__mro__):
+        for name, attribute in vars(klass).items():
+            if isinstance(attribute, Column):
+                found[name] = attribute
+    return found
@@ -1,10 +1,9 @@
 from typing import override
-import random
-import logging
-import paho.mqtt.client as paho
 
-from device import Device, CHANCE_TO_CHANGE, GENERAL_PARAMETERS
+from columns import Column
+from device import Device, Setter
 from device_types import DeviceType
+from runtime import RuntimeContext
 
 DEFAULT_POSITION = 100
 MIN_POSITION = 0
@@ -13,14 +12,16 @@ POSITION_RATE = 1
 
 
 class Curtain(Device):
+    __slots__ = ("_position",)
+    STATUSES = ("open", "closed")
+    COLUMNS = {"_status": Column(int), "_position": Column(int)}
+
     def __init__(
             self,
             device_id: str,
             room: str,
             name: str,
-            sender_id: str,
-            mqtt_client: paho.Client,
-            logger: logging.Logger,
+            context: RuntimeContext,
             status: str = "off",
             position: int = DEFAULT_POSITION,
     ):
@@ -29,10 +30,8 @@ class Curtain(Device):
             device_type=DeviceType.CURTAIN,
             room=room,
             name=name,
-            mqtt_client=mqtt_client,
             status=status,
-            logger=logger,
-            sender_id=sender_id
+            context=context,
         )
         if MIN_POSITION <= position <= MAX_POSITION:
             self._position = position
@@ -50,43 +49,34 @@ class Curtain(Device):
         else:
             raise ValueError(f"Position must be between {MIN_POSITION} and {MAX_POSITION}")
 
+    # Position only changes as the curtain moves
+    SETTERS: dict[str, Setter] = Device.SETTERS
+
+    @override
+    def parameters(self) -> dict:
+        return {
+            "position": self.position,
+        }
+
     @override
-    def tick(self) -> None:
+    def advance(self, action_parameters: dict, update_parameters: dict) -> None:
         """
-        Actions to perform on every iteration of the main loop.
-        - Adjust position
-        - Randomly apply status change
-        - Publish changes to MQTT
+        Adjusts position based on status
         """
-        action_parameters = {}
-        update_parameters = {}
-        # Adjust position
         if self.position > MIN_POSITION and self.status == "open":
             self.position -= POSITION_RATE
             action_parameters['position'] = self.position
         if self.position < MAX_POSITION and self.status == "closed":
             self.position += POSITION_RATE
             action_parameters['position'] = self.position
-        # Randomly lock or unlock
-        random.seed()
-        if random.random() < CHANCE_TO_CHANGE:
-            update_parameters['status'] = self.status = "closed" if self.status == "open" else "open"
-        self.publish_mqtt(action_parameters, update_parameters)
 
     @override
-    def update(self, new_values: dict) -> None:
-        for key, value in new_values.items():
-            if key in GENERAL_PARAMETERS:
-                try:
-                    match key:
-                        case "room":
-                            self.room = value
-                        case "name":
-                            self.name = value
-                        case "status":
-                            self.status = value
-                    self._logger.info(f"Setting parameter '{key}' to value '{value}'")
-                except ValueError:
-                    self._logger.exception(f"Incorrect value {value} for parameter {key}")
-            else:
-                raise ValueError(f"Incorrect parameter {key} for device type {self.type.value}")
+    def is_active(self) -> bool:
+        if self.status == "open":
+            return self.position > MIN_POSITION
+        return self.position < MAX_POSITION
+
+    @override
+    def random_change(self, action_parameters: dict, update_parameters: dict) -> None:
+        # Randomly open or close
+        update_parameters['status'] = self.status = "closed" if self.status == "open" else "open"
@@ -1,19 +1,48 @@
-import json
-import logging
-import paho.mqtt.client as paho
-from paho.mqtt.properties import Properties
-from paho.mqtt.packettypes import PacketTypes
+import math
+import sys
+from typing import Any, Callable
+
+from columns import Column
 from device_types import DeviceType
+from rng import RandomStream
+from runtime import RuntimeContext
+from serialization import JSON, Codec, sender_properties
 
 CHANCE_TO_CHANGE = 0.01
-GENERAL_PARAMETERS: list[str] = [
-    "room",
-    "name",
-    "status"
-]
+
+# Applies a value received in a message to a device, and the parser that turns the message's value into the one
+# the setter takes, if they differ
+Setter = tuple[Callable[[Any, Any], None], Callable[[Any], Any] | None]
+
+
+def message_topic(device_id: str, kind: str) -> str:
+    """
+    Topic of a device's messages, kind being its method such as "action" or "update".
+    """
+    return f"project/home/{device_id}/{kind}"
 
 
-class Device:
+def message_payload(contents: dict, codec: Codec = JSON) -> bytes:
+    return codec.encode({
+        "contents": contents,
+    })
+
+
+class Device(RandomStream):
+    """
+    Each device is its own RandomStream, seeded from the simulation's seed and its id, so its random decisions
+    don't need a separate generator object per device.
+    """
+    __slots__ = ("_id", "_type", "_room", "_name", "_status", "_context", "_store", "_row")
+    # Possible values of status, stored as the index of the current value
+    STATUSES: tuple[str, str] = ("off", "on")
+    # Attributes that can be moved into a ColumnStore, installed over their slots by __init_subclass__
+    COLUMNS: dict[str, Column] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, column in cls.__dict__.get("COLUMNS", {}).items():
+            column.install(cls, name)
 
     def __init__(
             self,
@@ -22,28 +51,17 @@ class Device:
             room: str,
             name: str,
             status: str,
-            mqtt_client: paho.Client,
-            logger: logging.Logger,
-            sender_id: str
+            context: RuntimeContext,
     ):
+        super().__init__(context.rng.seed_for(device_id))
+        self._store = None
+        self._row = 0
         self._id: str = device_id
         self._type: DeviceType = device_type
-        self._room: str = room
+        self._room: str = sys.intern(room)
         self._name: str = name
-        self._sender_id = sender_id
-        match self.type:
-            case DeviceType.DOOR_LOCK:
-                if status not in ['unlocked', 'locked']:
-                    raise ValueError(f"Status of {self.type.value} must be either 'unlocked' or 'locked'")
-            case DeviceType.CURTAIN:
-                if status not in ['open', 'closed']:
-                    raise ValueError(f"Status of {self.type.value} must be either 'open' or 'closed'")
-            case _:
-                if status not in ['on', 'off']:
-                    raise ValueError(f"Status of {self.type.value} must be either 'on' or 'off'")
-        self._status: str = status
-        self._mqtt_client = mqtt_client
-        self._logger = logger
+        self._context = context
+        self._status: int = self._status_index(status)
 
     @property
     def id(self) -> str:
@@ -59,7 +77,8 @@ class Device:
 
     @room.setter
     def room(self, value: str) -> None:
-        self._room = value
+        # Many devices share a room, so they can share the string too
+        self._room = sys.intern(value)
 
     @property
     def name(self) -> str:
@@ -71,42 +90,118 @@ class Device:
 
     @property
     def status(self) -> str:
-        return self._status
+        return self.STATUSES[self._status]
 
     @status.setter
     def status(self, value: str) -> None:
-        match self.type:
-            case DeviceType.DOOR_LOCK:
-                if value not in ['unlocked', 'locked']:
-                    raise ValueError(f"Status of {self.type.value} must be either 'unlocked' or 'locked'")
-            case DeviceType.CURTAIN:
-                if value not in ['open', 'closed']:
-                    raise ValueError(f"Status of {self.type.value} must be either 'open' or 'closed'")
-            case _:
-                if value not in ['on', 'off']:
-                    raise ValueError(f"Status of {self.type.value} must be either 'on' or 'off'")
-        self._status = value
+        self._status = self._status_index(value)
+
+    # Setters of the parameters messages can change, by parameter. Subclasses add their own to these
+    SETTERS: dict[str, Setter] = {
+        "room": (room.fset, None),
+        "name": (name.fset, None),
+        "status": (status.fset, None),
+    }
+
+    def _status_index(self, value: str) -> int:
+        if value not in self.STATUSES:
+            raise ValueError(
+                f"Status of {self.type.value} must be either '{self.STATUSES[0]}' or '{self.STATUSES[1]}'"
+            )
+        return self.STATUSES.index(value)
+
+    def to_dict(self) -> dict:
+        """
+        Returns the device's full state, in the same format the backend uses.
+        """
+        return {
+            "id": self.id,
+            "type": self.type.value,
+            "name": self.name,
+            "room": self.room,
+            "status": self.status,
+            "parameters": self.parameters(),
+        }
+
+    def parameters(self) -> dict:
+        raise NotImplementedError()
 
     def tick(self) -> None:
         """
-        Actions to perform on every iteration of the main loop
+        Actions to perform on every iteration of the main loop.
+        - Advance state that changes over time
+        - Randomly apply change
+        - Publish changes to MQTT
+        """
+        action_parameters = {}
+        update_parameters = {}
+        self.advance(action_parameters, update_parameters)
+        # The roll is made even while paused, so pausing doesn't shift every later random decision
+        if self.random() < CHANCE_TO_CHANGE and not self._context.changes_paused:
+            self.random_change(action_parameters, update_parameters)
+        self.publish_mqtt(action_parameters, update_parameters)
+
+    def advance(self, action_parameters: dict, update_parameters: dict) -> None:
+        """
+        Adjusts state that changes on its own over time, recording changes in the given dicts.
+        Does nothing for devices without such state.
+        """
+        pass
+
+    def is_active(self) -> bool:
+        """
+        Whether advance may change anything on the next tick. Devices that aren't active only need to be
+        ticked for their random changes.
+        """
+        return False
+
+    def next_change_delay(self) -> int:
+        """
+        Ticks until the next random change, distributed the same as rolling CHANCE_TO_CHANGE on every tick.
+        """
+        return int(math.log1p(-self.random()) / math.log1p(-CHANCE_TO_CHANGE)) + 1
+
+    def random_change(self, action_parameters: dict, update_parameters: dict) -> None:
+        """
+        Randomly changes a single setting to simulate human interaction, recording it in the given dicts.
         """
         raise NotImplementedError()
 
     def publish_mqtt(self, action_parameters: dict, update_parameters) -> None:
-        topic = f"project/home/{self.id}"
-        properties = Properties(PacketTypes.PUBLISH)
-        properties.UserProperty = [("sender_id", self._sender_id)]
+        context = self._context
+        if context.publish_filter is not None:
+            action_parameters = context.publish_filter.filter(self.id, action_parameters, "action")
+            update_parameters = context.publish_filter.filter(self.id, update_parameters, "update")
+            if not action_parameters and not update_parameters:
+                return
+        if context.publish_batcher is not None:
+            context.publish_batcher.add(self, action_parameters, update_parameters)
+            if not context.publish_batcher.keep_device_topics:
+                return
         if action_parameters:
-            payload = json.dumps({
-                "contents": action_parameters,
-            })
-            self._mqtt_client.publish(topic + "/action", payload.encode(), qos=2, properties=properties)
+            context.mqtt_client.publish(
+                message_topic(self.id, "action"), message_payload(action_parameters, context.codec), qos=context.qos,
+                properties=context.properties,
+            )
         if update_parameters:
-            payload = json.dumps({
-                "contents": update_parameters,
-            })
-            self._mqtt_client.publish(topic + "/update", payload.encode(), qos=2, properties=properties)
+            context.mqtt_client.publish(
+                message_topic(self.id, "update"), message_payload(update_parameters, context.codec), qos=context.qos,
+                properties=context.properties,
+            )
 
     def update(self, new_values: dict) -> None:
-        raise NotImplementedError()
+        """
+        Applies the parameters of an incoming message through SETTERS. Invalid values are logged and skipped, an
+        unknown parameter raises ValueError after the parameters before it were applied.
+        """
+        setters = self.SETTERS
+        for key, value in new_values.items():
+            setter = setters.get(key)
+            if setter is None:
+                raise ValueError(f"Incorrect parameter {key} for device type {self.type.value}")
+            apply, parse = setter
+            try:
+                apply(self, value if parse is None else parse(value))
+                self._context.logger.info(f"Setting parameter '{key}' to value '{value}'")
+            except ValueError:
+                self._context.logger.exception(f"Incorrect value {value} for parameter {key}")
@@ -0,0 +1,88 @@
+import zlib
+from typing import Iterator
+
+from device import Device
+from device_types import DeviceType
+
+
+class DeviceRegistry:
+    """
+    Holds every simulated device, indexed by id, type and room.
+    Lookups, inserts and deletes by id are O(1), and iteration follows insertion order.
+    Devices are also split into a fixed number of slices by a hash of their id, so the tick loop can spread them
+    across the tick interval.
+    """
+
+    def __init__(self, slices: int = 1):
+        self._devices: dict[str, Device] = {}
+        self._slices: list[dict[str, Device]] = [{} for _ in range(slices)]
+        self._by_type: dict[DeviceType, dict[str, Device]] = {device_type: {} for device_type in DeviceType}
+        self._by_room: dict[str, dict[str, Device]] = {}
+        # The room each device is currently indexed under, so renames can be re-indexed
+        self._rooms: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._devices
+
+    def __iter__(self) -> Iterator[Device]:
+        # Iterate over a copy so devices can be added or removed from the MQTT thread mid-tick
+        return iter(tuple(self._devices.values()))
+
+    def in_slice(self, index: int) -> tuple[Device, ...]:
+        return tuple(self._slices[index].values())
+
+    def get(self, device_id: str) -> Device | None:
+        return self._devices.get(device_id)
+
+    def add(self, device: Device) -> None:
+        if device.id in self._devices:
+            raise ValueError(f"Device ID {device.id} already exists")
+        self._devices[device.id] = device
+        self._slice_of(device.id)[device.id] = device
+        self._by_type[device.type][device.id] = device
+        self._by_room.setdefault(device.room, {})[device.id] = device
+        self._rooms[device.id] = device.room
+
+    def remove(self, device_id: str) -> Device | None:
+        device = self._devices.pop(device_id, None)
+        if device is None:
+            return None
+        del self._slice_of(device_id)[device_id]
+        del self._by_type[device.type][device_id]
+        self._unindex_room(device_id)
+        return device
+
+    def reindex(self, device: Device) -> None:
+        """
+        Updates the room index after a device's room has changed.
+        """
+        if self._rooms.get(device.id) == device.room:
+            return
+        self._unindex_room(device.id)
+        self._by_room.setdefault(device.room, {})[device.id] = device
+        self._rooms[device.id] = device.room
+
+    def by_type(self, device_type: DeviceType) -> list[Device]:
+        return list(self._by_type[device_type].values())
+
+    def count_by_type(self) -> dict[str, int]:
+        return {device_type.value: len(of_type) for device_type, of_type in self._by_type.items()}
+
+    def by_room(self, room: str) -> list[Device]:
+        return list(self._by_room.get(room, {}).values())
+
+    def rooms(self) -> list[str]:
+        return list(self._by_room)
+
+    def _slice_of(self, device_id: str) -> dict[str, Device]:
+        return self._slices[zlib.crc32(device_id.encode()) % len(self._slices)]
+
+    def _unindex_room(self, device_id: str) -> None:
+        room = self._rooms.pop(device_id)
+        devices_in_room = self._by_room[room]
+        del devices_in_room[device_id]
+        if not devices_in_room:
+            del self._by_room[room]
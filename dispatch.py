@@ -0,0 +1,33 @@
+from typing import Any, Callable
+
+from device import Device, message_topic
+
+# Handles a decoded message on one of a device's topics
+Handler = Callable[[Device, Any], None]
+
+
+class TopicRoutes:
+    """
+    Maps every topic of the simulated devices straight to the device and the handler of the topic's method, so
+    routing an incoming message is a single lookup instead of parsing its topic and finding the device.
+    Routes are added and removed along with the devices, so they're never rebuilt.
+    """
+
+    def __init__(self, handlers: dict[str, Handler]):
+        self._handlers = handlers
+        # Device, method and handler by topic
+        self._routes: dict[str, tuple[Device, str, Handler]] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def get(self, topic: str) -> tuple[Device, str, Handler] | None:
+        return self._routes.get(topic)
+
+    def add(self, device: Device) -> None:
+        for method, handler in self._handlers.items():
+            self._routes[message_topic(device.id, method)] = (device, method, handler)
+
+    def remove(self, device_id: str) -> None:
+        for method in self._handlers:
+            self._routes.pop(message_topic(device_id, method), None)
@@ -1,10 +1,9 @@
 from typing import override
-import random
-import logging
-import paho.mqtt.client as paho
 
-from device import Device, CHANCE_TO_CHANGE, GENERAL_PARAMETERS
+from columns import Column
+from device import Device, Setter
 from device_types import DeviceType
+from runtime import RuntimeContext
 
 DEFAULT_AUTO_LOCK = False
 DEFAULT_BATTERY = 100
@@ -12,20 +11,18 @@ MIN_BATTERY = 0
 MAX_BATTERY = 100
 BATTERY_DRAIN = 1
 
-PARAMETERS: list[str] = [
-    "auto_lock_enabled",
-]
-
 
 class DoorLock(Device):
+    __slots__ = ("_auto_lock_enabled", "_battery_level")
+    STATUSES = ("unlocked", "locked")
+    COLUMNS = {"_battery_level": Column(int)}
+
     def __init__(
             self,
             device_id: str,
             room: str,
             name: str,
-            sender_id: str,
-            mqtt_client: paho.Client,
-            logger: logging.Logger,
+            context: RuntimeContext,
             status: str = "unlocked",
             auto_lock_enabled: bool = DEFAULT_AUTO_LOCK,
             battery_level: int = DEFAULT_BATTERY,
@@ -35,10 +32,8 @@ class DoorLock(Device):
             device_type=DeviceType.DOOR_LOCK,
             room=room,
             name=name,
-            mqtt_client=mqtt_client,
             status=status,
-            logger=logger,
-            sender_id=sender_id
+            context=context,
         )
         self._auto_lock_enabled = auto_lock_enabled
         if MIN_BATTERY <= battery_level <= MAX_BATTERY:
@@ -65,45 +60,36 @@ class DoorLock(Device):
         else:
             raise ValueError(f"Battery level must be between {MIN_BATTERY} and {MAX_BATTERY}")
 
+    SETTERS: dict[str, Setter] = {
+        **Device.SETTERS,
+        "auto_lock_enabled": (auto_lock_enabled.fset, None),
+    }
+
+    @override
+    def parameters(self) -> dict:
+        return {
+            "auto_lock_enabled": self.auto_lock_enabled,
+            "battery_level": self.battery_level,
+        }
+
     @override
-    def tick(self) -> None:
+    def advance(self, action_parameters: dict, update_parameters: dict) -> None:
         """
-        Actions to perform on every iteration of the main loop.
-        - Drain battery
-        - Randomly apply status change
-        - Publish changes to MQTT
+        Drains the battery
         """
-        action_parameters = {}
-        update_parameters = {}
-        # Drain battery
         if self.battery_level >= MIN_BATTERY:
             try:
                 self.battery_level -= BATTERY_DRAIN
             except ValueError:
                 self.battery_level = MAX_BATTERY
         action_parameters['battery_level'] = self.battery_level
-        # Randomly lock or unlock
-        random.seed()
-        if random.random() < CHANCE_TO_CHANGE:
-            update_parameters['status'] = self.status = "locked" if self.status == "unlocked" else "unlocked"
-        self.publish_mqtt(action_parameters, update_parameters)
 
     @override
-    def update(self, new_values: dict) -> None:
-        for key, value in new_values.items():
-            if key in PARAMETERS + GENERAL_PARAMETERS:
-                try:
-                    match key:
-                        case "room":
-                            self.room = value
-                        case "name":
-                            self.name = value
-                        case "status":
-                            self.status = value
-                        case "auto_lock_enabled":
-                            self.auto_lock_enabled = value
-                    self._logger.info(f"Setting parameter '{key}' to value '{value}'")
-                except ValueError:
-                    self._logger.exception(f"Incorrect value {value} for parameter {key}")
-            else:
-                raise ValueError(f"Incorrect parameter {key} for device type {self.type.value}")
+    def is_active(self) -> bool:
+        # The battery is always draining
+        return True
+
+    @override
+    def random_change(self, action_parameters: dict, update_parameters: dict) -> None:
+        # Randomly lock or unlock
+        update_parameters['status'] = self.status = "locked" if self.status == "unlocked" else "unlocked"
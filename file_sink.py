@@ -0,0 +1,44 @@
+import json
+import threading
+from typing import Any, Callable
+
+
+class FileSink:
+    """
+    Writes published messages to a local file instead of sending them to a broker, one JSON object per line
+    with the simulated time, topic, QoS and payload.
+    Has the same publish() as a paho client, so it can be used wherever devices expect one.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float]):
+        self.path = path
+        self._clock = clock
+        # Opened on the first message, so a sink that never publishes doesn't touch the file
+        self._file = None
+        self._lock = threading.Lock()
+        self.messages = 0
+
+    def publish(
+            self,
+            topic: str,
+            payload: bytes | str | None = None,
+            qos: int = 0,
+            retain: bool = False,
+            properties: Any = None,
+    ) -> None:
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        line = json.dumps(
+            {"time": self._clock(), "topic": topic, "qos": qos, "payload": payload}, separators=(",", ":")
+        )
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "w", encoding="utf-8")
+            self._file.write(line + "\n")
+            self.messages += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
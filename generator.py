@@ -0,0 +1,179 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+import requests
+
+import air_conditioner
+import curtain
+import door_lock
+import light
+import water_heater
+from air_conditioner import AirConditioner
+from curtain import Curtain
+from device import Device
+from device_types import DeviceType
+from door_lock import DoorLock
+from light import Light
+from rng import RandomStream, SimulationRandom
+from water_heater import WaterHeater
+
+CLASSES: dict[DeviceType, type[Device]] = {
+    DeviceType.WATER_HEATER: WaterHeater,
+    DeviceType.LIGHT: Light,
+    DeviceType.AIR_CONDITIONER: AirConditioner,
+    DeviceType.DOOR_LOCK: DoorLock,
+    DeviceType.CURTAIN: Curtain,
+}
+
+# Numeric parameters that are varied between homes, as (lowest, highest, largest change from the template)
+JITTER: dict[DeviceType, dict[str, tuple[int, int, int]]] = {
+    DeviceType.WATER_HEATER: {
+        "temperature": (water_heater.ROOM_TEMPERATURE, water_heater.MAX_TEMPERATURE, 10),
+        "target_temperature": (water_heater.MIN_TEMPERATURE, water_heater.MAX_TEMPERATURE, 3),
+    },
+    DeviceType.LIGHT: {
+        "brightness": (light.MIN_BRIGHTNESS, light.MAX_BRIGHTNESS, 20),
+    },
+    DeviceType.AIR_CONDITIONER: {
+        "temperature": (air_conditioner.MIN_TEMPERATURE, air_conditioner.MAX_TEMPERATURE, 3),
+    },
+    DeviceType.DOOR_LOCK: {
+        "battery_level": (door_lock.MIN_BATTERY + 1, door_lock.MAX_BATTERY, 30),
+    },
+    DeviceType.CURTAIN: {
+        "position": (curtain.MIN_POSITION, curtain.MAX_POSITION, 50),
+    },
+}
+# Largest change of scheduled times, in minutes
+SCHEDULE_JITTER = 30
+# Concurrent requests when registering devices with the backend
+REGISTER_WORKERS = 8
+
+
+class HomeGenerator:
+    """
+    Generates any number of homes from a template device list such as data.json, as devices in the backend's
+    format. Every home gets its own ids and rooms, and jittered parameters and statuses.
+    By default every home has the template's devices, a mix of {device type: count} gives every home that many
+    devices of each type instead, cycling through the template's devices of the type.
+    Homes are generated lazily and reproducibly: the same seed always generates the same homes.
+    """
+
+    def __init__(
+            self,
+            templates: list[dict],
+            homes: int,
+            rng: SimulationRandom,
+            mix: dict[str, int] | None = None,
+    ):
+        if homes < 0:
+            raise ValueError(f"Number of homes can't be negative, got {homes} instead.")
+        self.homes = homes
+        self._rng = rng
+        if mix is None:
+            plan = list(templates)
+        else:
+            plan = []
+            for device_type, count in mix.items():
+                of_type = [template for template in templates if template["type"] == device_type]
+                if not of_type and count:
+                    raise ValueError(f"Template has no devices of type {device_type}")
+                plan.extend(of_type[index % len(of_type)] for index in range(count))
+        # Templates used more than once in a home get numbered ids
+        seen: dict[str, int] = {}
+        self._plan: list[tuple[dict, str]] = []
+        for template in plan:
+            copy = seen[template["id"]] = seen.get(template["id"], 0) + 1
+            self._plan.append((template, template["id"] if copy == 1 else f"{template['id']}-{copy}"))
+
+    def __len__(self) -> int:
+        return self.homes * len(self._plan)
+
+    def __iter__(self) -> Iterator[dict]:
+        for home in range(self.homes):
+            yield from self.home(home)
+
+    def home(self, index: int) -> Iterator[dict]:
+        random = self._rng.stream(f"home-{index}")
+        for template, device_key in self._plan:
+            device_type = DeviceType(template["type"])
+            parameters = dict(template.get("parameters", {}))
+            for parameter, (lowest, highest, spread) in JITTER[device_type].items():
+                if parameter in parameters:
+                    value = parameters[parameter] + random.randint(-spread, spread)
+                    parameters[parameter] = min(highest, max(lowest, value))
+            for parameter in ("scheduled_on", "scheduled_off"):
+                if parameter in parameters:
+                    parameters[parameter] = self._jitter_time(parameters[parameter], random)
+            yield {
+                "id": f"home-{index}-{device_key}",
+                "type": template["type"],
+                "name": template["name"],
+                "room": f"Home {index} {template['room']}",
+                "status": random.choice(CLASSES[device_type].STATUSES),
+                "parameters": parameters,
+            }
+
+    @staticmethod
+    def _jitter_time(value: str, random: RandomStream) -> str:
+        hours, minutes = value.split(":")
+        minutes_of_day = int(hours) * 60 + int(minutes) + random.randint(-SCHEDULE_JITTER, SCHEDULE_JITTER)
+        minutes_of_day %= 24 * 60
+        return f"{minutes_of_day // 60:02d}:{minutes_of_day % 60:02d}"
+
+
+class BackendRegistrar:
+    """
+    Registers generated devices with the backend, with a bounded number of requests in flight over keep-alive
+    connections, so devices are never all held in memory at once.
+    """
+
+    def __init__(
+            self,
+            api_url: str,
+            logger: logging.Logger,
+            workers: int = REGISTER_WORKERS,
+            session: requests.Session | None = None,
+    ):
+        self._url = api_url + '/api/devices'
+        self._logger = logger
+        self._workers = workers
+        self._session = session if session is not None else requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self.registered = 0
+        self.failed = 0
+
+    def register(self, devices: Iterable[dict]) -> int:
+        """
+        Posts every device to the backend. Returns how many were registered.
+        """
+        slots = threading.BoundedSemaphore(self._workers * 4)
+        lock = threading.Lock()
+
+        def post(device_data: dict) -> None:
+            try:
+                response = self._session.post(self._url, json=device_data)
+                succeeded = 200 <= response.status_code < 300
+                if not succeeded:
+                    self._logger.error(f"Failed to register device {device_data['id']}: {response.status_code}")
+            except requests.exceptions.RequestException as e:
+                self._logger.error(f"Failed to register device {device_data['id']}: {e}")
+                succeeded = False
+            finally:
+                slots.release()
+            with lock:
+                if succeeded:
+                    self.registered += 1
+                else:
+                    self.failed += 1
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="device-registrar") as executor:
+            for device_data in devices:
+                slots.acquire()
+                executor.submit(post, device_data)
+        self._logger.info(f"Registered {self.registered} devices with the backend, {self.failed} failed")
+        return self.registered
@@ -1,11 +1,9 @@
 import re
-import logging
 from typing import override
-import random
-import paho.mqtt.client as paho
 
-from device import Device, CHANCE_TO_CHANGE, GENERAL_PARAMETERS
+from device import Device, Setter
 from device_types import DeviceType
+from runtime import RuntimeContext
 
 DEFAULT_DIMMABLE = False
 DEFAULT_BRIGHTNESS = 80
@@ -15,23 +13,28 @@ DEFAULT_DYNAMIC_COLOR = False
 DEFAULT_COLOR = "#FFFFFF"
 COLOR_REGEX = '^#([0-9A-Fa-f]{3}|[0-9A-Fa-f]{6})$'
 
-PARAMETERS: list[str] = [
-    "brightness",
-    "color",
-    "is_dimmable",
-    "dynamic_color",
-]
+
+def parse_color(value: str) -> int:
+    """
+    Packs a hex color code into a 24-bit int, expanding the 3-digit form.
+    """
+    if not re.match(COLOR_REGEX, value):
+        raise ValueError(f"Color must be a valid hex code, got {value} instead.")
+    digits = value[1:]
+    if len(digits) == 3:
+        digits = "".join(digit * 2 for digit in digits)
+    return int(digits, 16)
 
 
 class Light(Device):
+    __slots__ = ("_is_dimmable", "_brightness", "_dynamic_color", "_color")
+
     def __init__(
             self,
             device_id: str,
             room: str,
             name: str,
-            sender_id: str,
-            mqtt_client: paho.Client,
-            logger: logging.Logger,
+            context: RuntimeContext,
             status: str = "off",
             is_dimmable: bool = DEFAULT_DIMMABLE,
             brightness: int = DEFAULT_BRIGHTNESS,
@@ -43,10 +46,8 @@ class Light(Device):
             device_type=DeviceType.LIGHT,
             room=room,
             name=name,
-            mqtt_client=mqtt_client,
             status=status,
-            logger=logger,
-            sender_id=sender_id
+            context=context,
         )
         self._is_dimmable = is_dimmable
         if MIN_BRIGHTNESS <= brightness <= MAX_BRIGHTNESS:
@@ -54,10 +55,7 @@ class Light(Device):
         else:
             raise ValueError(f"Brightness must be between {MIN_BRIGHTNESS} and {MAX_BRIGHTNESS}")
         self._dynamic_color = dynamic_color
-        if bool(re.match(COLOR_REGEX, color)):
-            self._color = color
-        else:
-            raise ValueError(f"Color must be a valid hex code, got {color} instead.")
+        self._color: int = parse_color(color)
 
     @property
     def is_dimmable(self) -> bool:
@@ -88,71 +86,50 @@ class Light(Device):
 
     @property
     def color(self) -> str:
-        return self._color
+        return f"#{self._color:06X}"
 
     @color.setter
     def color(self, value: str) -> None:
-        if bool(re.match(COLOR_REGEX, value)):
-            self._color = value
-        else:
-            raise ValueError(f"Color must be a valid hex code, got {value} instead.")
+        self._color = parse_color(value)
+
+    SETTERS: dict[str, Setter] = {
+        **Device.SETTERS,
+        "brightness": (brightness.fset, None),
+        "color": (color.fset, None),
+        "is_dimmable": (is_dimmable.fset, None),
+        "dynamic_color": (dynamic_color.fset, None),
+    }
 
     @override
-    def tick(self) -> None:
-        """
-        Actions to perform on every iteration of the main loop.
-        - Randomly apply change
-        - Publish changes to MQTT
-        """
-        action_parameters = {}
-        update_parameters = {}
-        random.seed()
-        if random.random() < CHANCE_TO_CHANGE:
-            elements = ['status']
-            if self.is_dimmable:
-                elements.append('brightness')
-            if self.dynamic_color:
-                elements.append('color')
-            element_to_change = random.choice(elements)
-            match element_to_change:
-                case 'status':
-                    update_parameters['status'] = self.status = 'on' if self.status == 'off' else 'off'
-                case 'brightness':
-                    next_brightness = self.brightness
-                    while next_brightness == self.brightness:
-                        next_brightness = random.randint(MIN_BRIGHTNESS, MAX_BRIGHTNESS)
-                    action_parameters['brightness'] = self.brightness = next_brightness
-                case 'color':
-                    next_color = int('0x' + self.color[1:], 16)
-                    while next_color == int('0x' + self.color[1:], 16):
-                        next_color = random.randrange(0, 2 ** 24)
-                    action_parameters['color'] = self.color = "#" + hex(next_color)[2:]
-                case _:
-                    print(f"Unknown element {element_to_change}")
-        self.publish_mqtt(action_parameters, update_parameters)
+    def parameters(self) -> dict:
+        return {
+            "brightness": self.brightness,
+            "color": self.color,
+            "is_dimmable": self.is_dimmable,
+            "dynamic_color": self.dynamic_color,
+        }
 
     @override
-    def update(self, new_values: dict) -> None:
-        for key, value in new_values.items():
-            if key in PARAMETERS + GENERAL_PARAMETERS:
-                try:
-                    match key:
-                        case "room":
-                            self.room = value
-                        case "name":
-                            self.name = value
-                        case "status":
-                            self.status = value
-                        case "brightness":
-                            self.brightness = value
-                        case "color":
-                            self.color = value
-                        case "is_dimmable":
-                            self.is_dimmable = value
-                        case "dynamic_color":
-                            self.color = value
-                    self._logger.info(f"Setting parameter '{key}' to value '{value}'")
-                except ValueError:
-                    self._logger.exception(f"Incorrect value {value} for parameter {key}")
-            else:
-                raise ValueError(f"Incorrect parameter {key} for device type {self.type.value}")
+    def random_change(self, action_parameters: dict, update_parameters: dict) -> None:
+        elements = ['status']
+        if self.is_dimmable:
+            elements.append('brightness')
+        if self.dynamic_color:
+            elements.append('color')
+        element_to_change = self.choice(elements)
+        match element_to_change:
+            case 'status':
+                update_parameters['status'] = self.status = 'on' if self.status == 'off' else 'off'
+            case 'brightness':
+                next_brightness = self.brightness
+                while next_brightness == self.brightness:
+                    next_brightness = self.randint(MIN_BRIGHTNESS, MAX_BRIGHTNESS)
+                action_parameters['brightness'] = self.brightness = next_brightness
+            case 'color':
+                next_color = self._color
+                while next_color == self._color:
+                    next_color = self.randrange(0, 2 ** 24)
+                self._color = next_color
+                action_parameters['color'] = self.color
+            case _:
+                print(f"Unknown element {element_to_change}")
@@ -1,18 +1,39 @@
-from datetime import time
-from time import sleep
-from typing import Any, cast
+from datetime import datetime, time
+from time import perf_counter, sleep
+from typing import Any, Callable, cast
 import paho.mqtt.client as paho
 import json
 import logging
 import logging.handlers
-import requests
 import os
 import sys
 import atexit
-import random
+import asyncio
+import threading
 
+from async_runtime import AsyncioHelper
+from bootstrap import DeviceLoader, peak_rss_mib
+from client_pool import ClientPool
+from cluster import Cluster, cluster_topics
+from clock import SimulationClock
+from dispatch import TopicRoutes
 from device import Device
+from device_registry import DeviceRegistry
 from device_types import DeviceType
+from file_sink import FileSink
+from generator import BackendRegistrar, HomeGenerator
+from metrics import CountingPublisher, Metrics, MetricsServer
+from outbound import OutboundQueue
+from trace_file import TraceWriter
+from publish_batcher import PublishBatcher, DEFAULT_TOPIC
+from publish_filter import PublishFilter
+from rng import SimulationRandom
+from runtime import RuntimeContext
+from scheduler import TickScheduler
+from serialization import JSON, codec, decode
+from sharding import HashRing, Supervisor
+from snapshot import SnapshotWriter, load_snapshot
+from subscriptions import CONTROL_TOPIC
 
 from air_conditioner import AirConditioner, Mode, FanSpeed, Swing
 from light import Light
@@ -22,31 +43,159 @@ from water_heater import WaterHeater
 
 BROKER_HOST = os.getenv("BROKER_HOST", "test.mosquitto.org")
 BROKER_PORT = int(os.getenv("BROKER_PORT", 1883))
+# Number of connections to the broker, each with its own network loop. Devices are spread across them by id
+MQTT_CLIENTS = int(os.getenv("MQTT_CLIENTS", 1))
 
 # How many times to attempt a connection request
 RETRIES = 5
 
 API_URL = os.getenv("API_URL", default='http://localhost:5200')
+# Devices to request per page at startup, unset to let the backend decide
+BOOTSTRAP_PAGE_SIZE = int(os.environ["BOOTSTRAP_PAGE_SIZE"]) if "BOOTSTRAP_PAGE_SIZE" in os.environ else None
 
-devices: list[Device] = []
+# "devices" subscribes only to the topics of simulated devices plus new device posts, "all" to project/home/#
+SUBSCRIBE_MODE = os.getenv("SUBSCRIBE_MODE", "devices")
+
+# "threaded" runs MQTT networking on paho's own thread, "asyncio" runs everything on a single event loop
+RUNTIME = os.getenv("RUNTIME", "threaded")
+
+# Local file the full device state is saved to, and restored from on startup. Empty to disable
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.json")
+# Seconds between snapshots
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 30))
+if not SNAPSHOT_INTERVAL > 0:
+    # Would write snapshots back to back
+    raise ValueError(f"SNAPSHOT_INTERVAL must be positive, got {SNAPSHOT_INTERVAL} instead.")
+
+# Number of worker processes the devices are split across, 1 runs everything in this process
+SHARDS = int(os.getenv("SHARDS", 1))
+# How often shard workers report their metrics to the supervisor
+SHARD_REPORT_TICKS = 15
+
+# Group of simulator replicas to split the devices with, each with its own HOSTNAME. New device posts are received
+# on a shared subscription. Unset to simulate every device in this instance
+CLUSTER_GROUP = os.getenv("CLUSTER_GROUP")
+# Seconds between the heartbeats members of a cluster group announce themselves with
+CLUSTER_HEARTBEAT = float(os.getenv("CLUSTER_HEARTBEAT", 5))
+
+# "device" calls tick() on every device, "numpy" advances each device type in batched array operations,
+# "events" only ticks devices that are changing or due a random change
+TICK_ENGINE = os.getenv("TICK_ENGINE", "device")
+
+# Set to "off" to publish every parameter on every tick, even when its value hasn't changed
+PUBLISH_FILTER = os.getenv("PUBLISH_FILTER", "on")
+# Per-parameter publish rules as JSON, e.g. '{"battery_level": {"deadband": 5, "max_interval": 60}}'
+PUBLISH_RULES = os.getenv("PUBLISH_RULES")
+# "off" publishes every device on its own topic, "tick", "room" or "type" also coalesces each tick's updates
+# into one message per tick, room or device type on PUBLISH_BATCH_TOPIC
+PUBLISH_BATCH = os.getenv("PUBLISH_BATCH", "off")
+PUBLISH_BATCH_TOPIC = os.getenv("PUBLISH_BATCH_TOPIC", DEFAULT_TOPIC)
+# Whether to keep publishing on the per-device topics while batching
+PUBLISH_BATCH_KEEP_DEVICE_TOPICS = os.getenv("PUBLISH_BATCH_KEEP_DEVICE_TOPICS", "off") == "on"
+# Encoding of published payloads: "json", or the more compact "msgpack" or "cbor" (which need their packages).
+# Binary payloads carry their MQTT content type, and incoming messages are decoded by theirs
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json")
+# Messages held while the broker is disconnected or slow, 0 to hand everything to paho, which holds them without limit
+OUTBOUND_CAPACITY = int(os.getenv("OUTBOUND_CAPACITY", 10_000))
+# "drop_oldest" or "pause" (random changes) when the buffer is full, or "coalesce", which always merges held messages
+# on the same topic into the latest value per device and parameter, and drops the oldest when the buffer is full
+OUTBOUND_POLICY = os.getenv("OUTBOUND_POLICY", "drop_oldest")
+# Held messages sent per second once the broker catches up
+OUTBOUND_DRAIN_RATE = float(os.getenv("OUTBOUND_DRAIN_RATE", 500))
+# Unacknowledged messages at which new messages are held instead of handed to paho
+OUTBOUND_MAX_INFLIGHT = int(os.getenv("OUTBOUND_MAX_INFLIGHT", 1000))
+QOS_DEVICE = int(os.getenv("QOS_DEVICE", 2))
+QOS_BATCH = int(os.getenv("QOS_BATCH", 1))
+# Seconds between ticks of the same device
+TICK_INTERVAL = float(os.getenv("TICK_INTERVAL", 2))
+# "skip" drops ticks whose time has passed after an overrun, "catch_up" runs them back to back
+TICK_POLICY = os.getenv("TICK_POLICY", "skip")
+# Number of groups the devices are split into, each ticked at a different offset within the interval
+TICK_SLICES = 1 if TICK_ENGINE in ("numpy", "events") else int(os.getenv("TICK_SLICES", 1))
+
+# Seed of every random decision, a run with the same seed and devices publishes the same messages.
+# A random seed is picked when unset, and saved to the environment so shard workers inherit it
+SIM_SEED = int(os.environ.setdefault("SIM_SEED", str(SimulationRandom().seed)))
+
+# How many times faster than real time simulated time passes, or "max" to run ticks back to back,
+# each moving simulated time forward by TICK_INTERVAL
+SIM_SPEED = os.getenv("SIM_SPEED", "1")
+# Simulated time to start at as an ISO date and time, e.g. "2025-01-01T06:00", unset to start at the current time
+SIM_START = datetime.fromisoformat(os.environ["SIM_START"]).timestamp() if "SIM_START" in os.environ else None
+# Simulated seconds to run for before exiting, unset to run forever
+SIM_DURATION = float(os.environ["SIM_DURATION"]) if "SIM_DURATION" in os.environ else None
+# File to write published messages to instead of connecting to the broker, unset to use the broker
+SINK_PATH = os.getenv("SINK_PATH")
+# "jsonl" writes every message as a line of JSON, "trace" writes compressed columnar chunks of parameter changes
+SINK_FORMAT = os.getenv("SINK_FORMAT", "jsonl")
+# Number of synthetic homes to simulate instead of the backend's devices, unset to simulate the backend's devices
+GENERATOR_HOMES = int(os.environ["GENERATOR_HOMES"]) if "GENERATOR_HOMES" in os.environ else None
+# Device list every synthetic home is generated from, a JSON file in the backend's format or "backend"
+GENERATOR_TEMPLATE = os.getenv("GENERATOR_TEMPLATE", "data.json")
+# Devices of each type in every home as JSON, e.g. '{"light": 6, "door_lock": 2}', unset to copy the template
+GENERATOR_MIX = json.loads(os.environ["GENERATOR_MIX"]) if "GENERATOR_MIX" in os.environ else None
+# Whether to also register the synthetic devices with the backend
+GENERATOR_REGISTER = os.getenv("GENERATOR_REGISTER", "off") == "on"
+# Port to serve Prometheus metrics on at /metrics, unset to disable. Shard workers serve on the following ports
+METRICS_PORT = int(os.environ["METRICS_PORT"]) if "METRICS_PORT" in os.environ else None
+
+devices = DeviceRegistry(slices=TICK_SLICES)
 logger = logging.getLogger(__name__)
+simulation_random = SimulationRandom(SIM_SEED)
+simulation_clock = SimulationClock(None if SIM_SPEED == "max" else float(SIM_SPEED), start=SIM_START)
+metrics = Metrics()
+
+
+def create_file_sink(path: str) -> FileSink | TraceWriter:
+    if SINK_FORMAT == "trace":
+        return TraceWriter(path, simulation_clock.now)
+    return FileSink(path, simulation_clock.now)
+
+
+file_sink = create_file_sink(SINK_PATH) if SINK_PATH else None
 
 
-def create_device(device_data: dict) -> None:
+def create_engine() -> Any:
+    """
+    Returns the engine that ticks the devices instead of ticking them one by one, None for TICK_ENGINE "device".
+    """
+    if TICK_ENGINE == "numpy":
+        from tick_engine import VectorizedTickEngine
+
+        return VectorizedTickEngine(simulation_random, simulation_clock, changes_paused=lambda: context.changes_paused)
+    if TICK_ENGINE == "events":
+        from event_engine import EventTickEngine
+
+        return EventTickEngine(changes_paused=lambda: context.changes_paused)
+    return None
+
+
+engine = create_engine()
+
+
+def create_owned_device(device_data: dict) -> None:
+    """
+    Creates a posted device, or forwards it to the cluster member that owns it.
+    """
+    if cluster is not None and "id" in device_data and not cluster.owns(device_data["id"]):
+        cluster.forward(device_data)
+        return
+    create_device(device_data=device_data)
+
+
+def create_device(device_data: dict, quiet: bool = False) -> None:
     required_fields = {'id', 'room', 'name', 'type'}
     if not required_fields <= device_data.keys():
         logger.error(f"Missing required field(s): {required_fields - device_data.keys()} ")
         return
-    if id_exists(device_data["id"]):
+    if device_data["id"] in devices:
         logger.error("ID already exists")
         return
     kwargs = {
         'device_id': device_data['id'],
         'room': device_data['room'],
         'name': device_data['name'],
-        'mqtt_client': mqtt_client,
-        'logger': logger,
-        'sender_id': client_id
+        'context': context,
     }
     parameters = device_data.get("parameters", {})
     if 'status' in device_data:
@@ -58,8 +207,6 @@ def create_device(device_data: dict) -> None:
                     kwargs['temperature'] = parameters['temperature']
                 if 'target_temperature' in parameters:
                     kwargs['target_temperature'] = parameters['target_temperature']
-                if 'is_heating' in parameters:
-                    kwargs['is_heating'] = parameters['is_heating']
                 if 'timer_enabled' in parameters:
                     kwargs['timer_enabled'] = parameters['timer_enabled']
                 if 'scheduled_on' in parameters:
@@ -105,8 +252,13 @@ def create_device(device_data: dict) -> None:
                 logger.error(f"Unknown device type {device_data['type']}")
                 return
         if new_device is not None:
-            devices.append(new_device)
-            logger.info("Device added successfully")
+            devices.add(new_device)
+            routes.add(new_device)
+            pool.add_device(new_device.id)
+            if engine is not None:
+                engine.attach(new_device)
+            if not quiet:
+                logger.info("Device added successfully")
             return
         else:
             logger.error(f"Failed to create device {device_data['id']}")
@@ -115,12 +267,17 @@ def create_device(device_data: dict) -> None:
         logger.exception(f"Failed to create device {device_data['id']}")
 
 
-# Checks the validity of the device id
-def id_exists(device_id):
-    for device in devices:
-        if device_id == device.id:
-            return True
-    return False
+def delete_device(device_id: str) -> bool:
+    device = devices.remove(device_id)
+    if device is None:
+        return False
+    routes.remove(device_id)
+    pool.remove_device(device_id)
+    if engine is not None:
+        engine.detach(device)
+    if context.publish_filter is not None:
+        context.publish_filter.forget(device_id)
+    return True
 
 
 def on_connect(client, _userdata, _connect_flags, reason_code, _properties):
@@ -129,14 +286,17 @@ def on_connect(client, _userdata, _connect_flags, reason_code, _properties):
         with open("./status", "a") as file:
             file.write("ready\n")
         logger.info("Connected successfully")
-        client.subscribe("project/home/#")
+        pool.on_connect(client)
+        if cluster is not None and client is cluster.client:
+            cluster.on_connect()
 
 
-def on_disconnect(_client, _userdata, _disconnect_flags, reason_code, _properties=None):
+def on_disconnect(client, _userdata, _disconnect_flags, reason_code, _properties=None):
     if reason_code == 0:
         logger.warning(f"Disconnected from broker.")
     else:
         logger.warning(f"Disconnected from broker with reason: {reason_code}")
+    pool.on_disconnect(client)
     with open("./status", "w") as file:
         file.write("healthy\n")
 
@@ -148,8 +308,33 @@ def on_subscribe(
         reason_code_list: list[paho.ReasonCodes],
         _properties: paho.Properties,
 ):
-    for rc in reason_code_list:
-        logger.info(f"Subscribed with reason code {rc}")
+    failures = [rc for rc in reason_code_list if rc.is_failure]
+    for rc in failures:
+        logger.error(f"Subscription failed with reason code {rc}")
+    logger.info(f"Subscribed to {len(reason_code_list) - len(failures)} topic(s)")
+
+
+def update_device(device: Device, payload: dict) -> None:
+    try:
+        device.update(payload)
+    except ValueError:
+        logger.exception(f"Failed to update device {device.id}")
+        metrics.message_errors += 1
+    devices.reindex(device)
+    if engine is not None:
+        engine.wake(device)
+
+
+def delete_routed_device(device: Device, _payload: Any) -> None:
+    if delete_device(device.id):
+        logger.info("Device deleted successfully")
+
+
+def create_routes() -> TopicRoutes:
+    return TopicRoutes({"action": update_device, "update": update_device, "delete": delete_routed_device})
+
+
+routes = create_routes()
 
 
 def on_message(
@@ -157,22 +342,58 @@ def on_message(
         _userdata: Any,
         msg: paho.MQTTMessage,
 ):
-    sender_id = None
     props = msg.properties
-    user_props = getattr(props, "UserProperty", None)
-    if user_props is not None:
-        sender_id = dict(user_props).get("sender_id")
+    sender_id = None
+    # Looked up in place, the properties are usually a single pair
+    for key, value in getattr(props, "UserProperty", ()):
+        if key == "sender_id":
+            sender_id = value
+            break
 
     if sender_id is None:
         logger.error("Message missing sender")
 
+    # Our own messages are dropped before anything else is done with them. no_local only filters out the messages a
+    # connection published itself, so with a pool of clients, messages published on the others can arrive here
     if sender_id == client_id:
+        metrics.self_echo_dropped += 1
+        return
+
+    topic = msg.topic
+    route = routes.get(topic)
+    if route is None:
+        on_unrouted_message(msg)
+        return
+
+    device, method, handler = route
+    logger.info(f"MQTT Message Received on {topic}")
+    metrics.count_received(method)
+    try:
+        handler(device, decode(cast(bytes, msg.payload), getattr(props, "ContentType", None)))
+    except UnicodeError:
+        logger.exception("Error decoding payload")
+        metrics.message_errors += 1
+    except ValueError:
+        logger.exception("Value error")
+        metrics.message_errors += 1
+
+
+def on_unrouted_message(msg: paho.MQTTMessage) -> None:
+    """
+    Handles messages on topics that aren't routed to a device: new device posts, cluster messages, and messages for
+    devices that don't exist or belong to another shard or cluster member.
+    """
+    if cluster is not None and msg.topic.startswith(cluster.prefix):
+        on_cluster_message(msg)
+        return
+
+    if (shard_ring is not None or cluster is not None) and not owned_by_this_instance(msg.topic):
         return
 
     logger.info(f"MQTT Message Received on {msg.topic}")
     payload = cast(bytes, msg.payload)
     try:
-        payload = json.loads(payload.decode("utf-8"))
+        payload = decode(payload, getattr(msg.properties, "ContentType", None))
 
         # Extract device_id from topic: expected format project/home/<device_id>/<method>
         topic_parts = msg.topic.split('/')
@@ -181,61 +402,537 @@ def on_message(
             method = topic_parts[-1]
             match method:
                 case "action" | "update":
-                    for device in devices:
-                        if device.id == device_id:
-                            try:
-                                device.update(payload)
-                                return
-                            except ValueError:
-                                logger.exception(f"Failed to update device {device.id}")
-                                return
-                    logger.error(f"Device ID {device_id} not found")
+                    metrics.count_received(method)
+                    device = devices.get(device_id)
+                    if device is None:
+                        logger.error(f"Device ID {device_id} not found")
+                        metrics.message_errors += 1
+                        return
+                    update_device(device, payload)
+                    return
                 case "post":
-                    create_device(device_data=payload)
+                    metrics.count_received(method)
+                    create_owned_device(payload)
                     return
                 case "delete":
-                    index_to_delete = None
-                    if id_exists(device_id):
-                        for index, device in enumerate(devices):
-                            if device.id == device_id:
-                                index_to_delete = index
-                        if index_to_delete is not None:
-                            devices.pop(index_to_delete)
-                            logger.info("Device deleted successfully")
-                            return
+                    metrics.count_received(method)
+                    if delete_device(device_id):
+                        logger.info("Device deleted successfully")
+                        return
                     logger.error("ID not found")
+                    metrics.message_errors += 1
                     return
                 case _:
                     logger.error(f"Unknown method: {method}")
+                    metrics.message_errors += 1
                     return
         else:
             logger.error(f"Incorrect topic {msg.topic}")
+            metrics.message_errors += 1
     except UnicodeError:
         logger.exception("Error decoding payload")
+        metrics.message_errors += 1
     except ValueError:
         logger.exception("Value error")
+        metrics.message_errors += 1
+
+
+def on_cluster_message(msg: paho.MQTTMessage) -> None:
+    try:
+        message = decode(cast(bytes, msg.payload), getattr(msg.properties, "ContentType", None))
+        device_data = cluster.on_message(msg.topic, message)
+    except (UnicodeError, ValueError, AttributeError):
+        logger.exception(f"Invalid cluster message on {msg.topic}")
+        metrics.message_errors += 1
+        return
+    if device_data is not None:
+        metrics.count_received("post")
+        # Forwarded by the member that received the post, never forwarded again
+        create_device(device_data=device_data)
+
+
+def owns(device_id: str) -> bool:
+    """
+    Whether this process simulates the device, when shards or the members of a cluster split the devices.
+    """
+    if shard_ring is not None and shard_ring.owner(device_id) != shard_index:
+        return False
+    return cluster is None or cluster.owns(device_id)
+
+
+def owned_by_this_instance(topic: str) -> bool:
+    topic_parts = topic.split('/')
+    if len(topic_parts) != 4 or cluster is not None and topic_parts[3] == "post":
+        # Cluster members route posts by the id in their payload
+        return True
+    return owns(topic_parts[2])
+
+
+def create_mqtt_client(new_client_id: str) -> paho.Client:
+    client = paho.Client(paho.CallbackAPIVersion.VERSION2, protocol=paho.MQTTv5, client_id=new_client_id)
+    client.on_message = on_message
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_subscribe = on_subscribe
+    return client
+
+
+def create_context() -> RuntimeContext:
+    """
+    Builds the dependencies shared by every device, around the current client pool.
+    """
+    publish_filter = None
+    if PUBLISH_FILTER == "on":
+        if PUBLISH_RULES:
+            publish_filter = PublishFilter.from_json(json.loads(PUBLISH_RULES), clock=simulation_clock.now)
+        else:
+            publish_filter = PublishFilter(clock=simulation_clock.now)
+    publisher = CountingPublisher(file_sink, metrics) if file_sink is not None else pool
+    # The pool holds an outbound buffer per connection
+    outbound = pool if file_sink is None and OUTBOUND_CAPACITY > 0 else None
+    # JSON lines files store payloads as text
+    payload_codec = JSON if file_sink is not None and SINK_FORMAT == "jsonl" else codec(PAYLOAD_FORMAT)
+    publish_batcher = None
+    if PUBLISH_BATCH != "off":
+        publish_batcher = PublishBatcher(
+            mqtt_client=publisher,
+            sender_id=client_id,
+            topic=PUBLISH_BATCH_TOPIC,
+            group_by=PUBLISH_BATCH,
+            qos=QOS_BATCH,
+            keep_device_topics=PUBLISH_BATCH_KEEP_DEVICE_TOPICS,
+            codec=payload_codec,
+        )
+    return RuntimeContext(
+        mqtt_client=publisher,
+        logger=logger,
+        sender_id=client_id,
+        qos=QOS_DEVICE,
+        publish_filter=publish_filter,
+        publish_batcher=publish_batcher,
+        rng=simulation_random,
+        clock=simulation_clock,
+        codec=payload_codec,
+        outbound=outbound,
+    )
+
+
+def create_clients(base_client_id: str) -> list[paho.Client]:
+    """
+    Creates MQTT_CLIENTS clients, with ids derived from base_client_id when there's more than one.
+    Messages are still sent with base_client_id as their sender, so instances recognize them as a whole.
+    """
+    if MQTT_CLIENTS == 1:
+        return [create_mqtt_client(base_client_id)]
+    return [create_mqtt_client(f"{base_client_id}-{index}") for index in range(MQTT_CLIENTS)]
+
+
+def create_pool(clients: list[paho.Client]) -> ClientPool:
+    outbound = None
+    if OUTBOUND_CAPACITY > 0:
+        def outbound(publisher: Any) -> OutboundQueue:
+            return OutboundQueue(
+                publisher, OUTBOUND_CAPACITY, OUTBOUND_POLICY, OUTBOUND_DRAIN_RATE, OUTBOUND_MAX_INFLIGHT, logger
+            )
+    control_topics = (CONTROL_TOPIC,)
+    if CLUSTER_GROUP is not None:
+        control_topics = cluster_topics(CLUSTER_GROUP, client_id)
+    # Cluster members only subscribe to the devices they own
+    per_device = SUBSCRIBE_MODE == "devices" or CLUSTER_GROUP is not None
+    return ClientPool(
+        clients, logger, metrics, per_device=per_device, outbound=outbound, control_topics=control_topics
+    )
+
+
+def create_cluster() -> Cluster | None:
+    if CLUSTER_GROUP is None:
+        return None
+    # Cluster messages bypass the outbound buffer, a held heartbeat is useless once it's sent
+    return Cluster(
+        pool.connections[0].client, CLUSTER_GROUP, client_id, context.codec, context.properties, logger,
+        heartbeat=CLUSTER_HEARTBEAT,
+    )
 
 
 client_id = f"simulator-{os.getenv('HOSTNAME')}"
-mqtt_client = paho.Client(paho.CallbackAPIVersion.VERSION2, protocol=paho.MQTTv5, client_id=client_id)
-mqtt_client.on_message = on_message
-mqtt_client.on_connect = on_connect
-mqtt_client.on_disconnect = on_disconnect
-mqtt_client.on_subscribe = on_subscribe
+pool = create_pool(create_clients(client_id))
+context = create_context()
+cluster = create_cluster()
+
+device_loader = DeviceLoader(API_URL, logger, RETRIES, page_size=BOOTSTRAP_PAGE_SIZE)
+# Loads the devices taken over from cluster members that left, apart from the startup load, which may still be running
+rebalance_loader = DeviceLoader(API_URL, logger, RETRIES, page_size=BOOTSTRAP_PAGE_SIZE)
+# One rebalance load runs at a time, and members that leave while it runs are loaded once it finishes
+rebalance_lock = threading.Lock()
+rebalance_running = False
+rebalance_pending = False
+snapshot_writer: SnapshotWriter | None = None
+# Set once ticking starts
+scheduler: TickScheduler | None = None
+metrics_server: MetricsServer | None = None
+
+# Set in shard worker processes, used to ignore devices owned by other shards
+shard_ring: HashRing | None = None
+shard_index: int | None = None
 
 
 @atexit.register
 def shutdown() -> None:
-    mqtt_client.loop_stop()
-    mqtt_client.disconnect()
+    if cluster is not None:
+        cluster.leave()
+    pool.loop_stop()
+    pool.disconnect()
+    if file_sink is not None:
+        file_sink.close()
+    if snapshot_writer is not None:
+        snapshot_writer.stop()
+        try:
+            snapshot_writer.write()
+        except (OSError, ValueError):
+            logger.exception("Failed to save snapshot")
     if os.path.exists("./status"):
         os.remove("./status")
     logger.info("Shutting down")
 
 
-def main() -> None:
-    with open("./status", "w") as file:
-        file.write("healthy\n")
+# Backend fields of a device that aren't simulated, a device that already exists takes them from the backend
+METADATA_FIELDS = ("name", "room")
+
+
+def load_device(device_data: dict) -> None:
+    device_id = device_data.get("id")
+    if device_id is not None and not owns(device_id):
+        return
+    device = devices.get(device_id)
+    if device is None:
+        create_device(device_data=device_data)
+        return
+    # Restored from the snapshot, or delivered again when the loader retries a page. The simulated state is kept
+    changes = {
+        field: device_data[field]
+        for field in METADATA_FIELDS if field in device_data and device_data[field] != getattr(device, field)
+    }
+    if changes:
+        try:
+            device.update(changes)
+        except ValueError:
+            logger.exception(f"Failed to update device {device_id}")
+        devices.reindex(device)
+
+
+def fetch_devices(on_device: Callable[[dict], None], loader: DeviceLoader = device_loader) -> int:
+    """
+    Streams the device list from the backend, calling on_device for each device as it arrives.
+    Returns the number of devices received, which is 0 if every attempt failed.
+    """
+    return loader.load(on_device)
+
+
+def call_directly(function: Callable[..., Any], *args: Any) -> None:
+    function(*args)
+
+
+def restore_snapshot() -> str | None:
+    """
+    Creates the devices saved in the local snapshot, with the state they had when it was taken.
+    Returns the backend ETag the snapshot was taken against, if known.
+    """
+    if not SNAPSHOT_PATH or GENERATOR_HOMES is not None or not os.path.exists(SNAPSHOT_PATH):
+        return None
+    start = perf_counter()
+    try:
+        device_list, etag = load_snapshot(SNAPSHOT_PATH)
+    except (OSError, ValueError, KeyError):
+        logger.exception(f"Failed to read snapshot {SNAPSHOT_PATH}")
+        return None
+    for device_data in device_list:
+        load_device(device_data)
+    logger.info(f"Restored {len(devices)} devices from {SNAPSHOT_PATH} in {(perf_counter() - start) * 1000:.0f}ms")
+    return etag
+
+
+def sync_with_backend(etag: str | None, restored: bool, call: Callable[..., Any] = call_directly) -> None:
+    """
+    Loads the devices from the backend. Devices restored from a snapshot keep their simulated state and take the
+    backend's name and room, and the ones the backend no longer has are deleted.
+    Device changes are made through call, so they can be handed over to another thread.
+    """
+    backend_ids = set()
+
+    def on_device(device_data: dict) -> None:
+        backend_ids.add(device_data.get("id"))
+        call(load_device, device_data)
+
+    device_loader.load(on_device, etag=etag if restored else None)
+    if device_loader.not_modified:
+        logger.info("Snapshot is up to date with the backend")
+    elif restored and device_loader.complete:
+        call(delete_stale_devices, backend_ids)
+    elif restored:
+        logger.warning("Failed to reconcile snapshot with the backend, continuing with the snapshot")
+
+
+def delete_stale_devices(backend_ids: set[str]) -> None:
+    for device in devices:
+        if device.id not in backend_ids and delete_device(device.id):
+            logger.info(f"Deleted device {device.id}, which no longer exists in the backend")
+
+
+def create_generator(loader: DeviceLoader = device_loader) -> HomeGenerator | None:
+    if GENERATOR_TEMPLATE == "backend":
+        templates: list[dict] = []
+        fetch_devices(templates.append, loader)
+    else:
+        with open(GENERATOR_TEMPLATE) as file:
+            templates = json.load(file)
+    if not templates:
+        return None
+    return HomeGenerator(templates, GENERATOR_HOMES, simulation_random, mix=GENERATOR_MIX)
+
+
+def generate_devices(call: Callable[..., Any] = call_directly) -> None:
+    """
+    Creates the devices of GENERATOR_HOMES synthetic homes, only the ones this process owns when sharded or clustered.
+    Devices are generated one at a time, so only the created devices are held in memory.
+    Device changes are made through call, so they can be handed over to another thread.
+    """
+    start = perf_counter()
+    generator = create_generator()
+    if generator is None:
+        logger.error(f"Template {GENERATOR_TEMPLATE} has no devices")
+        return
+
+    def owned(device_data: dict) -> bool:
+        return owns(device_data["id"])
+
+    for device_data in filter(owned, generator):
+        call(create_device, device_data, True)
+    logger.info(
+        f"Generated {len(generator)} devices in {GENERATOR_HOMES} homes in {perf_counter() - start:.2f}s, "
+        f"peak RSS {peak_rss_mib():.1f} MiB"
+    )
+    if GENERATOR_REGISTER:
+        # Generating again is cheaper than holding every device's data until registration
+        BackendRegistrar(API_URL, logger).register(filter(owned, generator))
+
+
+def load_devices(etag: str | None, restored: bool, call: Callable[..., Any] = call_directly) -> None:
+    if GENERATOR_HOMES is not None:
+        generate_devices(call)
+    else:
+        sync_with_backend(etag, restored, call)
+
+
+def loads_before_ticking() -> bool:
+    """
+    Whether the whole fleet is loaded before the first tick. Generated fleets and runs on a clock that isn't real
+    time are meant to be reproducible, and ticks made while devices are still arriving would depend on how fast
+    they arrive.
+    """
+    return GENERATOR_HOMES is not None or simulation_clock.speed != 1
+
+
+def load_owned_devices(call: Callable[..., Any] = call_directly) -> None:
+    """
+    Creates the devices this cluster member took over from another one, with their state from the backend, or
+    generated again from the seed.
+    """
+    if GENERATOR_HOMES is None:
+        fetch_devices(lambda device_data: call(load_device, device_data), rebalance_loader)
+        return
+    generator = create_generator(rebalance_loader)
+    for device_data in generator if generator is not None else ():
+        if device_data["id"] not in devices and owns(device_data["id"]):
+            call(create_device, device_data, True)
+
+
+def rebalance(joined: list[str], left: list[str]) -> None:
+    """
+    Hands over the devices that members who joined now own, and loads the ones taken over from members who left
+    in the background.
+    """
+    global rebalance_running, rebalance_pending
+    handed_over = [device.id for device in devices if not owns(device.id)]
+    for device_id in handed_over:
+        delete_device(device_id)
+    if handed_over:
+        logger.info(f"Handed over {len(handed_over)} devices to {', '.join(joined)}")
+    if not left:
+        return
+    logger.info(f"Loading the devices taken over from {', '.join(left)}")
+    # Like at startup, devices are created on the loop's thread in the asyncio runtime
+    call = asyncio.get_running_loop().call_soon_threadsafe if RUNTIME == "asyncio" else call_directly
+    with rebalance_lock:
+        rebalance_pending = True
+        if rebalance_running:
+            return
+        rebalance_running = True
+    threading.Thread(target=run_rebalance_loads, args=(call,), name="device-rebalancer", daemon=True).start()
+
+
+def run_rebalance_loads(call: Callable[..., Any]) -> None:
+    """
+    Loads the owned devices until no member left since the last load started, as the devices of members that
+    left during a load may not have been owned yet when it got to them.
+    """
+    global rebalance_running, rebalance_pending
+    while True:
+        with rebalance_lock:
+            if not rebalance_pending:
+                rebalance_running = False
+                return
+            rebalance_pending = False
+        try:
+            load_owned_devices(call)
+        except Exception:
+            logger.exception("Failed to load the devices taken over from other members")
+
+
+def join_cluster() -> None:
+    """
+    Connects and waits a heartbeat for the other members to answer, so only this member's share is loaded.
+    """
+    connect_to_broker()
+    sleep(cluster.heartbeat)
+    cluster.poll()
+
+
+def start_snapshots() -> None:
+    global snapshot_writer
+    # Synthetic devices are generated again from the seed on startup, so they aren't saved
+    if SNAPSHOT_PATH and GENERATOR_HOMES is None:
+        snapshot_writer = SnapshotWriter(
+            SNAPSHOT_PATH, devices, SNAPSHOT_INTERVAL, logger, etag=lambda: device_loader.etag
+        )
+        snapshot_writer.start()
+
+
+def start_metrics(port: int) -> None:
+    global metrics_server
+    metrics.gauge("simulator_devices", "Simulated devices, by type", lambda: devices.count_by_type(), label="type")
+
+    def per_connection(stat: str) -> Callable[[], dict]:
+        return lambda: {index: stats[stat] for index, stats in pool.stats().items()}
+
+    def scheduler_stat(stat: str) -> Callable[[], float]:
+        return lambda: scheduler.stats()[stat] if scheduler is not None else 0
+
+    metrics.gauge(
+        "simulator_tick_lag_seconds", "How late the last tick started after its slot", scheduler_stat("last_lag")
+    )
+    metrics.gauge(
+        "simulator_tick_overruns_total", "Ticks that took longer than their slot", scheduler_stat("overruns"),
+        metric_type="counter",
+    )
+    metrics.gauge(
+        "simulator_ticks_skipped_total", "Tick slots dropped after an overrun", scheduler_stat("skipped"),
+        metric_type="counter",
+    )
+
+    metrics.gauge(
+        "simulator_mqtt_connected", "1 while the connection is up",
+        lambda: {index: int(stats["connected"]) for index, stats in pool.stats().items()}, label="connection",
+    )
+    metrics.gauge(
+        "simulator_mqtt_published_total", "Messages handed to the connection", per_connection("published"),
+        label="connection", metric_type="counter",
+    )
+    metrics.gauge(
+        "simulator_mqtt_disconnects_total", "Times the connection was lost", per_connection("disconnects"),
+        label="connection", metric_type="counter",
+    )
+    metrics.gauge(
+        "simulator_mqtt_inflight_messages", "QoS 1 and 2 messages sent and not yet acknowledged",
+        per_connection("inflight"), label="connection",
+    )
+    metrics.gauge(
+        "simulator_mqtt_queued_messages", "Messages held by paho until they're sent and acknowledged",
+        per_connection("queued_messages"), label="connection",
+    )
+    metrics.gauge(
+        "simulator_mqtt_queued_packets", "Packets waiting to be written to the socket",
+        per_connection("queued_packets"), label="connection",
+    )
+    metrics.gauge("simulator_outbound_depth", "Messages held until the broker can take them", lambda: (
+        context.outbound.depth if context.outbound is not None else 0
+    ))
+    metrics.gauge("simulator_outbound_dropped_total", "Held messages dropped because the buffer was full", lambda: (
+        context.outbound.dropped if context.outbound is not None else 0
+    ), metric_type="counter")
+    metrics.gauge("simulator_outbound_coalesced_total", "Messages merged into a held message", lambda: (
+        context.outbound.coalesced if context.outbound is not None else 0
+    ), metric_type="counter")
+    if cluster is not None:
+        metrics.gauge("simulator_cluster_members", "Live members of the cluster group", lambda: len(cluster.members))
+    metrics.gauge("simulator_random_changes_paused", "1 while random changes are paused by a full buffer", lambda: (
+        int(context.changes_paused)
+    ))
+    metrics_server = MetricsServer(metrics, port, logger)
+    metrics_server.start()
+
+
+def tick(slice_index: int) -> None:
+    start = perf_counter()
+    if engine is not None:
+        engine.tick()
+    else:
+        for device in devices.in_slice(slice_index):
+            device.tick()
+    if context.publish_filter is not None:
+        for device_id, action_parameters, update_parameters in context.publish_filter.due():
+            if (device := devices.get(device_id)) is not None:
+                device.publish_mqtt(action_parameters, update_parameters)
+    if context.publish_batcher is not None:
+        context.publish_batcher.flush()
+    if context.outbound is not None:
+        context.outbound.drain()
+    if cluster is not None and (change := cluster.poll()) is not None:
+        rebalance(*change)
+    pool.flush()
+    metrics.tick_duration.observe(perf_counter() - start)
+
+
+def connect_to_broker() -> None:
+    if file_sink is not None:
+        logger.info(f"Writing messages to {file_sink.path} instead of the broker")
+        return
+    pool.connect_async(BROKER_HOST, BROKER_PORT, 60)
+    pool.loop_start()
+
+
+def create_scheduler() -> TickScheduler:
+    global scheduler
+    if simulation_clock.speed is None:
+        # Sleeping on the simulated clock moves it forward instead of waiting, so ticks run back to back
+        scheduler = TickScheduler(
+            interval=TICK_INTERVAL,
+            policy=TICK_POLICY,
+            slices=TICK_SLICES,
+            logger=logger,
+            clock=simulation_clock.now,
+            sleep=simulation_clock.sleep,
+            sleep_async=simulation_clock.sleep_async,
+        )
+    else:
+        scheduler = TickScheduler(interval=TICK_INTERVAL, policy=TICK_POLICY, slices=TICK_SLICES, logger=logger)
+    return scheduler
+
+
+def run_duration() -> float | None:
+    """
+    Returns SIM_DURATION in seconds of the scheduler's clock, which runs slower than simulated time.
+    """
+    if SIM_DURATION is None or simulation_clock.speed is None:
+        return SIM_DURATION
+    return SIM_DURATION / simulation_clock.speed
+
+
+def log_run_summary(wall_start: float) -> None:
+    wall_time = perf_counter() - wall_start
+    logger.info(f"Simulated {simulation_clock.elapsed / 3600:.2f} hours in {wall_time:.2f}s of real time")
+
+
+def setup_logging(filename: str) -> None:
     logging.basicConfig(
         format="[%(asctime)s] %(levelname)s in %(module)s: %(message)s",
         handlers=[
@@ -243,7 +940,7 @@ def main() -> None:
             logging.StreamHandler(),
             # Writes to a log file which rotates every 1mb, or gets overwritten when the app is restarted
             logging.handlers.RotatingFileHandler(
-                filename="simulator.log",
+                filename=filename,
                 mode='w',
                 maxBytes=1024 * 1024,
                 backupCount=3
@@ -251,39 +948,160 @@ def main() -> None:
         ],
         level=logging.INFO,
     )
-    logger.info("Starting SmartHomeSimulator")
 
+
+def shard_metrics(scheduler: TickScheduler) -> dict:
+    return {
+        "shard": shard_index,
+        "devices": len(devices),
+        "ticks": scheduler.ticks,
+        "overruns": scheduler.overruns,
+        "skipped": scheduler.skipped,
+        "published": context.publish_filter.sent if context.publish_filter is not None else 0,
+        "suppressed": context.publish_filter.suppressed if context.publish_filter is not None else 0,
+    }
+
+
+def run_shard(shard: int, shards: int, shard_devices: list[dict], metrics_queue: Any) -> None:
+    """
+    Entry point of a shard worker process, simulating the devices assigned to it by the supervisor.
+    """
+    global client_id, pool, file_sink, context, shard_ring, shard_index
+    setup_logging(f"simulator-{shard}.log")
+    client_id = f"simulator-{os.getenv('HOSTNAME')}-{shard}"
+    pool = create_pool(create_clients(client_id))
+    if SINK_PATH:
+        file_sink = create_file_sink(f"{SINK_PATH}.{shard}")
+    context = create_context()
+    shard_ring = HashRing(range(shards))
+    shard_index = shard
+    logger.info(f"Starting shard {shard + 1}/{shards}")
+    if METRICS_PORT is not None:
+        start_metrics(METRICS_PORT + shard)
+
+    for device_data in shard_devices:
+        create_device(device_data=device_data)
+    if GENERATOR_HOMES is not None:
+        generate_devices()
+
+    connect_to_broker()
+
+    scheduler = create_scheduler()
+
+    def tick_and_report(slice_index: int) -> None:
+        tick(slice_index)
+        if scheduler.ticks % SHARD_REPORT_TICKS == 0:
+            metrics_queue.put(shard_metrics(scheduler))
+
+    scheduler.run(tick_and_report, duration=run_duration())
+
+
+def main() -> None:
+    with open("./status", "w") as file:
+        file.write("healthy\n")
+    setup_logging("simulator.log")
+    logger.info(f"Starting SmartHomeSimulator with seed {SIM_SEED}")
+
+    if cluster is not None and (SHARDS > 1 or file_sink is not None):
+        logger.error("CLUSTER_GROUP can't be combined with SHARDS or SINK_PATH. Shutting down.")
+        sys.exit(1)
+
+    if SHARDS > 1 and GENERATOR_HOMES is not None:
+        # Every worker generates the homes itself, keeping only the devices it owns
+        sys.exit(Supervisor(shards=SHARDS, worker=run_shard, logger=logger).run([]))
+
+    if SHARDS > 1:
+        logger.info("Fetching devices . . .")
+        device_map: dict[str, dict] = {}
+        fetch_devices(lambda device_data: device_map.setdefault(device_data.get("id"), device_data))
+        if not device_map:
+            logger.error("Failed to fetch devices. Shutting down.")
+            sys.exit(1)
+        sys.exit(Supervisor(shards=SHARDS, worker=run_shard, logger=logger).run(list(device_map.values())))
+
+    if METRICS_PORT is not None:
+        start_metrics(METRICS_PORT)
+
+    if RUNTIME == "asyncio":
+        asyncio.run(main_async())
+        return
+
+    start = perf_counter()
+    if cluster is not None:
+        join_cluster()
+    etag = restore_snapshot()
     logger.info("Fetching devices . . .")
-    for attempt in range(RETRIES):
-        try:
-            response = requests.get(API_URL + '/api/devices')
-            if 200 <= response.status_code < 400:
-                for device_data in response.json():
-                    create_device(device_data=device_data)
-                break
-            else:
-                delay = 2 ** attempt + random.random()
-                logger.error(f"Failed to get devices {response.status_code}.")
-                logger.error(f"{response.text}")
-                logger.error(f"Attempt {attempt + 1}/{RETRIES} failed. Retrying in {delay:.2f} seconds...")
-                sleep(delay)
-        except requests.exceptions.ConnectionError:
-            logger.error(f"Failed to connect to backend")
-            delay = 2 ** attempt + random.random()
-            logger.error(f"Attempt {attempt + 1}/{RETRIES} failed. Retrying in {delay:.2f} seconds...")
-            sleep(delay)
-
-    if not devices:
+    if loads_before_ticking():
+        load_devices(etag, bool(devices))
+    else:
+        # Devices start ticking as soon as the first ones arrive, the rest keep loading in the background
+        loader = threading.Thread(
+            target=load_devices, args=(etag, bool(devices)), name="device-loader", daemon=True
+        )
+        loader.start()
+        while not devices and loader.is_alive():
+            loader.join(0.1)
+
+    # A cluster member may own none of the devices until others leave
+    if not devices and cluster is None:
         logger.error("Failed to fetch devices. Shutting down.")
         sys.exit(1)
 
-    mqtt_client.connect_async(BROKER_HOST, BROKER_PORT, 60)
-    mqtt_client.loop_start()
+    logger.info(f"Started ticking {perf_counter() - start:.2f}s after startup")
+    start_snapshots()
 
-    while True:
-        sleep(2)
-        for device in devices:
-            device.tick()
+    if cluster is None:
+        connect_to_broker()
+
+    scheduler = create_scheduler()
+    wall_start = perf_counter()
+    scheduler.run(tick, duration=run_duration())
+    log_run_summary(wall_start)
+
+
+async def main_async() -> None:
+    """
+    Runs the startup fetch, MQTT network I/O, message handling and ticking on a single event loop thread.
+    """
+    loop = asyncio.get_running_loop()
+    helpers = [AsyncioHelper(loop, client, logger) for client in pool.clients]
+
+    start = perf_counter()
+    if cluster is not None:
+        await asyncio.gather(*(helper.connect(BROKER_HOST, BROKER_PORT, 60) for helper in helpers))
+        await asyncio.sleep(cluster.heartbeat)
+        cluster.poll()
+    etag = restore_snapshot()
+    logger.info("Fetching devices . . .")
+    # requests is blocking, so only the download runs in a worker thread, the devices are created on the loop.
+    # Devices start ticking as soon as the first ones arrive, the rest keep loading in the background
+    loading = loop.run_in_executor(None, load_devices, etag, bool(devices), loop.call_soon_threadsafe)
+    if loads_before_ticking():
+        # The devices were handed to the loop before the result, so they're all created once it's awaited
+        await loading
+    while not devices and not loading.done():
+        await asyncio.wait({loading}, timeout=0.1)
+
+    if not devices and cluster is None:
+        logger.error("Failed to fetch devices. Shutting down.")
+        sys.exit(1)
+
+    logger.info(f"Started ticking {perf_counter() - start:.2f}s after startup")
+    start_snapshots()
+
+    if file_sink is not None:
+        logger.info(f"Writing messages to {file_sink.path} instead of the broker")
+    elif cluster is None:
+        await asyncio.gather(*(helper.connect(BROKER_HOST, BROKER_PORT, 60) for helper in helpers))
+
+    scheduler = create_scheduler()
+    wall_start = perf_counter()
+    try:
+        await scheduler.run_async(tick, duration=run_duration())
+        log_run_summary(wall_start)
+    finally:
+        for helper in helpers:
+            helper.disconnect()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Upper bounds of the tick duration histogram's buckets, in seconds
+TICK_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Kinds of per-device topics, anything else published is counted as "other"
+TOPIC_KINDS = ("action", "update")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # The last count is of values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Simulator internals in the Prometheus text format.
+    Counters updated on the hot paths are plain ints and dicts, without locks: render() copies them in single steps
+    that the GIL keeps consistent. Each is written from one thread, except incoming message counts with several
+    MQTT clients, where a rare concurrent increment may be lost. Gauges are read when rendered.
+    """
+
+    def __init__(self):
+        # Publishes by (topic kind, QoS)
+        self.published: dict[tuple[str, int], int] = {}
+        # Incoming messages by method
+        self.received: dict[str, int] = {}
+        self.message_errors = 0
+        self.self_echo_dropped = 0
+        self.tick_duration = Histogram(TICK_BUCKETS)
+        self._gauges: list[tuple[str, str, str, str | None, Callable[[], Any]]] = []
+
+    def count_published(self, topic: str, qos: int) -> None:
+        kind = topic[topic.rfind("/") + 1:]
+        key = (kind if kind in TOPIC_KINDS else "other", qos)
+        self.published[key] = self.published.get(key, 0) + 1
+
+    def count_received(self, method: str) -> None:
+        self.received[method] = self.received.get(method, 0) + 1
+
+    def gauge(
+            self,
+            name: str,
+            description: str,
+            read: Callable[[], Any],
+            label: str | None = None,
+            metric_type: str = "gauge",
+    ) -> None:
+        """
+        Adds a metric whose value is read when rendering, a gauge unless another type is given, such as a counter
+        kept by another object. With a label, read returns a dict of values by label value.
+        """
+        self._gauges.append((name, description, metric_type, label, read))
+
+    def render(self) -> str:
+        lines = []
+        lines += header("simulator_published_total", "Messages published, by topic kind and QoS", "counter")
+        for (kind, qos), value in sorted(tuple(self.published.items())):
+            lines.append(f'simulator_published_total{{kind="{kind}",qos="{qos}"}} {value}')
+        lines += header("simulator_received_total", "Messages received from other instances, by method", "counter")
+        for method, value in sorted(tuple(self.received.items())):
+            lines.append(f'simulator_received_total{{method="{method}"}} {value}')
+        lines += header("simulator_message_errors_total", "Received messages that couldn't be handled", "counter")
+        lines.append(f"simulator_message_errors_total {self.message_errors}")
+        lines += header("simulator_self_echo_dropped_total", "Received messages sent by this instance", "counter")
+        lines.append(f"simulator_self_echo_dropped_total {self.self_echo_dropped}")
+        lines += self._render_histogram(
+            "simulator_tick_duration_seconds", "Time spent ticking the devices of a slice", self.tick_duration
+        )
+        for name, description, metric_type, label, read in self._gauges:
+            lines += header(name, description, metric_type)
+            try:
+                value = read()
+            except Exception:
+                logging.getLogger(__name__).exception(f"Failed to read {name}")
+                continue
+            if label is None:
+                lines.append(f"{name} {value}")
+            else:
+                for label_value, item in sorted(value.items()):
+                    lines.append(f'{name}{{{label}="{label_value}"}} {item}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(name: str, description: str, histogram: Histogram) -> list[str]:
+        # Copy first, so the buckets, sum and count agree with each other
+        counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+        lines = header(name, description, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {sum(counts)}')
+        lines.append(f"{name}_sum {total}")
+        lines.append(f"{name}_count {count}")
+        return lines
+
+
+def header(name: str, description: str, metric_type: str) -> list[str]:
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+
+
+class CountingPublisher:
+    """
+    Counts every publish in the metrics, before handing it to the client.
+    """
+    __slots__ = ("_client", "_metrics")
+
+    def __init__(self, client: Any, metrics: Metrics):
+        self._client = client
+        self._metrics = metrics
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False, properties: Any = None):
+        self._metrics.count_published(topic, qos)
+        return self._client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+
+
+class MetricsServer:
+    """
+    Serves the metrics on /metrics from a daemon thread, so scrapes never block the tick loop.
+    """
+
+    def __init__(self, metrics: Metrics, port: int, logger: logging.Logger, host: str = ""):
+        self._metrics = metrics
+        self._logger = logger
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        metrics = self._metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                # Scrapes every few seconds would flood the log
+                pass
+
+        return Handler
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        self._logger.info(f"Serving metrics on port {self.port}")
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
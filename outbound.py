@@ -0,0 +1,207 @@
+import collections
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+import paho.mqtt.client as paho
+
+from serialization import content_codec
+
+# What to do when a message arrives and the buffer is full
+POLICIES = ("drop_oldest", "coalesce", "pause")
+
+
+class HeldMessage:
+    """
+    A message waiting in the buffer. Under the coalesce policy, later messages on the same topic are merged into it,
+    keeping the latest value of every (device, parameter).
+    """
+    __slots__ = ("topic", "payload", "qos", "retain", "properties", "changes")
+
+    def __init__(self, topic: str, payload: Any, qos: int, retain: bool, properties: Any):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties
+        # Decoded contents by (device id, method), only once another message was merged in
+        self.changes: dict[tuple[str | None, str | None], dict] | None = None
+
+    def merge(self, payload: Any) -> None:
+        decode = content_codec(getattr(self.properties, "ContentType", None)).decode
+        if self.changes is None:
+            self.changes = {}
+            self._add(decode(self.payload))
+        self._add(decode(payload))
+
+    def encoded(self) -> Any:
+        if self.changes is None:
+            return self.payload
+        encode = content_codec(getattr(self.properties, "ContentType", None)).encode
+        if (None, None) in self.changes:
+            return encode({"contents": self.changes[(None, None)]})
+        return encode({"updates": [
+            {"id": device_id, "method": method, "contents": contents}
+            for (device_id, method), contents in self.changes.items()
+        ]})
+
+    def _add(self, message: dict) -> None:
+        if "updates" in message:
+            # A batched message from PublishBatcher
+            for update in message["updates"]:
+                self.changes.setdefault((update["id"], update["method"]), {}).update(update["contents"])
+        else:
+            self.changes.setdefault((None, None), {}).update(message.get("contents", {}))
+
+
+class OutboundQueue:
+    """
+    Stands between the devices and the client, so a slow or disconnected broker doesn't make paho queue messages
+    in memory without limit.
+    Messages go straight to the client while it's connected and fewer than max_inflight of them are unacknowledged.
+    Otherwise they're held here, up to capacity, and drain() sends them in order at no more than drain_rate per
+    second once the client catches up, so a backlog doesn't flood the broker after a reconnect.
+    Under the "coalesce" policy, a message on a topic that's already held is always merged into the held one, which
+    keeps the latest value of every parameter and moves to the back of the queue, as if it had just arrived.
+    When the buffer is full and a message can't be merged:
+    - "drop_oldest" and "coalesce" drop the oldest message
+    - "pause" drops the oldest message and pauses random changes until half the buffer has drained
+    """
+
+    def __init__(
+            self,
+            client: paho.Client,
+            capacity: int = 10_000,
+            policy: str = "drop_oldest",
+            drain_rate: float = 500,
+            max_inflight: int = 1000,
+            logger: logging.Logger | None = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        if capacity < 1:
+            raise ValueError(f"Outbound capacity must be at least 1, got {capacity} instead.")
+        if policy not in POLICIES:
+            raise ValueError(f"Outbound policy must be one of {POLICIES}, got {policy} instead.")
+        if drain_rate <= 0:
+            raise ValueError(f"Drain rate must be positive, got {drain_rate} instead.")
+        self._client = client
+        self.capacity = capacity
+        self.policy = policy
+        self._drain_rate = drain_rate
+        self._max_inflight = max_inflight
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._clock = clock
+        # Held messages by topic under the coalesce policy, by arrival order otherwise
+        self._held: collections.OrderedDict[Any, HeldMessage] = collections.OrderedDict()
+        self._order = 0
+        self._lock = threading.Lock()
+        self._connected = False
+        self._allowance = 0.0
+        self._last_drain = clock()
+        self.paused = False
+        # Messages this queue handed to paho that haven't been acknowledged yet, with their QoS, by mid. Other
+        # messages published on the same client, such as cluster heartbeats, aren't counted
+        self._unacknowledged: dict[int, tuple[paho.MQTTMessageInfo, int]] = {}
+        self.sent = 0
+        # Metrics
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._held)
+
+    @property
+    def inflight(self) -> int:
+        if len(self._unacknowledged) >= self._max_inflight:
+            # paho may acknowledge a message before _send records it, which leaves it here until paho marks it
+            # as published
+            for mid, (info, _) in list(self._unacknowledged.items()):
+                if info.is_published():
+                    self._unacknowledged.pop(mid, None)
+        return len(self._unacknowledged)
+
+    def publish(self, topic: str, payload: Any = None, qos: int = 0, retain: bool = False, properties: Any = None):
+        if self._connected and not self._held and self.inflight < self._max_inflight:
+            return self._send(topic, payload, qos, retain, properties)
+        with self._lock:
+            self._hold(topic, payload, qos, retain, properties)
+        return None
+
+    def drain(self) -> int:
+        """
+        Sends held messages, as many as the rate limit allows since the last drain. Returns how many were sent.
+        """
+        now = self._clock()
+        elapsed, self._last_drain = now - self._last_drain, now
+        if not self._connected or not self._held:
+            # Allowance only builds up while there's a backlog to send, so an idle period doesn't allow a burst
+            self._allowance = 0.0
+            return 0
+        self._allowance += elapsed * self._drain_rate
+        sent = 0
+        while self._connected and self._allowance >= 1 and self.inflight < self._max_inflight:
+            with self._lock:
+                if not self._held:
+                    break
+                _, message = self._held.popitem(last=False)
+                if self.paused and len(self._held) <= self.capacity // 2:
+                    self.paused = False
+                    self._logger.info("Outbound buffer drained, resuming random changes")
+            self._send(message.topic, message.encoded(), message.qos, message.retain, message.properties)
+            self._allowance -= 1
+            sent += 1
+        return sent
+
+    def on_connect(self) -> None:
+        # paho sends the QoS 1 and 2 messages it kept from the last connection again, and reports them once they're
+        # acknowledged, but QoS 0 messages that weren't written before the disconnect are never reported
+        for mid, (_, qos) in list(self._unacknowledged.items()):
+            if qos == 0:
+                self._unacknowledged.pop(mid, None)
+        self._last_drain = self._clock()
+        self._allowance = 0.0
+        self._connected = True
+        if self._held:
+            self._logger.info(f"Draining {len(self._held)} held messages at {self._drain_rate:g}/s")
+
+    def on_disconnect(self) -> None:
+        self._connected = False
+
+    def on_publish(self, _client: paho.Client, _userdata: Any, mid: int, _reason_code: Any, _properties: Any) -> None:
+        self._unacknowledged.pop(mid, None)
+
+    def _send(self, topic: str, payload: Any, qos: int, retain: bool, properties: Any) -> paho.MQTTMessageInfo:
+        info = self._client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        # paho keeps QoS 1 and 2 messages published while disconnected, and sends them once it reconnects
+        if info.rc == paho.MQTT_ERR_SUCCESS or (qos > 0 and info.rc == paho.MQTT_ERR_NO_CONN):
+            self._unacknowledged[info.mid] = info, qos
+            if info.is_published():
+                # Acknowledged while it was being published
+                self._unacknowledged.pop(info.mid, None)
+            self.sent += 1
+        else:
+            self.dropped += 1
+        return info
+
+    def _hold(self, topic: str, payload: Any, qos: int, retain: bool, properties: Any) -> None:
+        if self.policy == "coalesce":
+            held = self._held.get(topic)
+            if held is not None:
+                held.merge(payload)
+                # Sent in the order of the latest values, like the messages it replaces
+                self._held.move_to_end(topic)
+                self.coalesced += 1
+                return
+            key = topic
+        else:
+            key = self._order
+            self._order += 1
+        if len(self._held) >= self.capacity:
+            self._held.popitem(last=False)
+            self.dropped += 1
+            if self.policy == "pause" and not self.paused:
+                self.paused = True
+                self._logger.warning("Outbound buffer is full, pausing random changes")
+        self._held[key] = HeldMessage(topic, payload, qos, retain, properties)
@@ -0,0 +1,70 @@
+from typing import TYPE_CHECKING
+
+import paho.mqtt.client as paho
+
+from serialization import JSON, Codec, sender_properties
+
+if TYPE_CHECKING:
+    from device import Device
+
+DEFAULT_TOPIC = "project/simulator/batch"
+# How updates are split into messages on every flush
+GROUP_BY = ("tick", "room", "type")
+# Room names become a topic level, so the wildcards, the level separator and the escape character itself are
+# percent-encoded, which keeps every room on a topic of its own
+TOPIC_LEVEL_ESCAPES = str.maketrans({char: f"%{ord(char):02X}" for char in "%+#/\0"})
+
+
+def topic_level(name: str) -> str:
+    return name.translate(TOPIC_LEVEL_ESCAPES)
+
+
+class PublishBatcher:
+    """
+    Collects every update produced during one pass of the main loop and publishes them
+    as a single compact message per tick, room or device type.
+    """
+
+    def __init__(
+            self,
+            mqtt_client: paho.Client,
+            sender_id: str,
+            topic: str = DEFAULT_TOPIC,
+            group_by: str = "tick",
+            qos: int = 1,
+            keep_device_topics: bool = False,
+            codec: Codec = JSON,
+    ):
+        if group_by not in GROUP_BY:
+            raise ValueError(f"Batches must be grouped by one of {GROUP_BY}, got {group_by} instead.")
+        self._mqtt_client = mqtt_client
+        self._topic = topic
+        self._group_by = group_by
+        self._qos = qos
+        self.keep_device_topics = keep_device_topics
+        self._codec = codec
+        self._properties = sender_properties(sender_id, codec.content_type)
+        self._pending: dict[str, list[dict]] = {}
+        self._room_topics: dict[str, str] = {}
+
+    def add(self, device: "Device", action_parameters: dict, update_parameters: dict) -> None:
+        match self._group_by:
+            case "room":
+                group = self._room_topics.get(device.room)
+                if group is None:
+                    group = self._room_topics[device.room] = f"{self._topic}/{topic_level(device.room)}"
+            case "type":
+                group = f"{self._topic}/{device.type.value}"
+            case _:
+                group = self._topic
+        updates = self._pending.setdefault(group, [])
+        if action_parameters:
+            updates.append({"id": device.id, "method": "action", "contents": action_parameters})
+        if update_parameters:
+            updates.append({"id": device.id, "method": "update", "contents": update_parameters})
+
+    def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for topic, updates in pending.items():
+            payload = self._codec.encode({"updates": updates})
+            self._mqtt_client.publish(topic, payload, qos=self._qos, properties=self._properties)
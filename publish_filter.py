@@ -0,0 +1,126 @@
+import heapq
+import time
+from typing import Any, Callable
+
+
+class PublishRule:
+    """
+    Limits how often a single parameter is published.
+    - deadband: numeric changes smaller than this are not published
+    - min_interval: seconds that must pass between two publishes of the parameter, a change within it is held
+      back and published once it expires unless a newer value replaces it
+    - max_interval: seconds after which a change is published even if it's within the deadband
+    """
+
+    def __init__(self, deadband: float = 0, min_interval: float = 0, max_interval: float | None = None):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+
+DEFAULT_RULES: dict[str, PublishRule] = {
+    "battery_level": PublishRule(deadband=5, max_interval=60),
+}
+
+
+class PublishFilter:
+    """
+    Remembers the last value published for every (device, parameter) pair and drops values that
+    wouldn't tell subscribers anything new.
+    """
+
+    def __init__(
+            self,
+            rules: dict[str, PublishRule] | None = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._rules = DEFAULT_RULES if rules is None else rules
+        self._clock = clock
+        # device id -> parameter -> (last published value, time it was published)
+        self._last: dict[str, dict[str, tuple[Any, float]]] = {}
+        # device id -> (kind, parameter) -> (latest value held back by min_interval, time it's due)
+        self._pending: dict[str, dict[tuple[str, str], tuple[Any, float]]] = {}
+        self._due: list[tuple[float, str, str, str]] = []
+        self.sent = 0
+        self.suppressed = 0
+
+    @staticmethod
+    def from_json(rules: dict[str, dict], clock: Callable[[], float] = time.monotonic) -> "PublishFilter":
+        return PublishFilter({parameter: PublishRule(**rule) for parameter, rule in rules.items()}, clock=clock)
+
+    def filter(self, device_id: str, parameters: dict, kind: str = "update") -> dict:
+        """
+        Returns the subset of parameters that should be published, and records them as published. Values held back
+        by min_interval are returned by due once it expires, kind tells which message they were meant for.
+        """
+        if not parameters:
+            return parameters
+        now = self._clock()
+        last_values = self._last.setdefault(device_id, {})
+        pending = self._pending.get(device_id)
+        passed = {}
+        for key, value in parameters.items():
+            if pending is not None and (held := pending.pop((kind, key), None)) is not None:
+                # A held back value replaced by a newer one is never published
+                self.suppressed += 1
+                due_time = held[1]
+            else:
+                due_time = None
+            last = last_values.get(key)
+            if last is not None and not self._should_publish(key, value, last, now):
+                rule = self._rules.get(key)
+                if rule is not None and value != last[0] and now - last[1] < rule.min_interval:
+                    if due_time is None:
+                        due_time = last[1] + rule.min_interval
+                        heapq.heappush(self._due, (due_time, device_id, kind, key))
+                    pending = self._pending.setdefault(device_id, {})
+                    pending[(kind, key)] = (value, due_time)
+                else:
+                    self.suppressed += 1
+                continue
+            last_values[key] = (value, now)
+            passed[key] = value
+            self.sent += 1
+        if pending is not None and not pending:
+            del self._pending[device_id]
+        return passed
+
+    def due(self) -> list[tuple[str, dict, dict]]:
+        """
+        Returns the values held back by min_interval whose interval has expired, as (device id, action parameters,
+        update parameters) to publish through the device again.
+        """
+        now = self._clock()
+        released: dict[str, tuple[dict, dict]] = {}
+        while self._due and self._due[0][0] <= now:
+            due_time, device_id, kind, key = heapq.heappop(self._due)
+            pending = self._pending.get(device_id)
+            # Entries of values that were published, replaced by a later hold or forgotten are skipped
+            if pending is None or (held := pending.get((kind, key))) is None or held[1] != due_time:
+                continue
+            del pending[(kind, key)]
+            if not pending:
+                del self._pending[device_id]
+            action_parameters, update_parameters = released.setdefault(device_id, ({}, {}))
+            (action_parameters if kind == "action" else update_parameters)[key] = held[0]
+        return [(device_id, action, update) for device_id, (action, update) in released.items()]
+
+    def forget(self, device_id: str) -> None:
+        self._last.pop(device_id, None)
+        self._pending.pop(device_id, None)
+
+    def _should_publish(self, key: str, value: Any, last: tuple[Any, float], now: float) -> bool:
+        last_value, last_time = last
+        if value == last_value:
+            return False
+        rule = self._rules.get(key)
+        if rule is None:
+            return True
+        elapsed = now - last_time
+        if elapsed < rule.min_interval:
+            return False
+        if rule.max_interval is not None and elapsed >= rule.max_interval:
+            return True
+        if isinstance(value, (int, float)) and isinstance(last_value, (int, float)):
+            return abs(value - last_value) >= rule.deadband
+        return True
@@ -0,0 +1,249 @@
+"""
+Republishes a recorded trace to the broker, to load-test the backend with a reproducible workload.
+
+    python replay.py <trace> [--speed N | --speed max] [--rate N] [--inflight N] [--qos N]
+
+Accepts both sink formats written with SINK_PATH: compressed traces (SINK_FORMAT=trace) and JSON lines.
+Traces are read as a stream, so they don't need to fit in memory.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+import paho.mqtt.client as paho
+
+from device import message_payload, message_topic
+from serialization import sender_properties
+from trace_file import MAGIC, iter_trace
+
+BROKER_HOST = os.getenv("BROKER_HOST", "test.mosquitto.org")
+BROKER_PORT = int(os.getenv("BROKER_PORT", 1883))
+# Seconds between progress log lines
+REPORT_INTERVAL = 10
+
+logger = logging.getLogger(__name__)
+
+# A message to replay: time it was recorded at, device id, "action" or "update", and its contents
+Message = tuple[float, str, str, dict]
+
+
+def read_messages(path: str) -> Iterator[Message]:
+    """
+    Yields the messages of a trace in the order they were recorded.
+    Rows of a compressed trace recorded at the same time for the same device and kind are one message, and
+    batched messages of a JSON lines trace are split into one message per device.
+    """
+    with open(path, "rb") as file:
+        is_trace = file.read(len(MAGIC)) == MAGIC
+    if is_trace:
+        for (ts, device_id, kind), events in itertools.groupby(
+                iter_trace(path), key=lambda event: (event.ts, event.device_id, event.kind)
+        ):
+            yield ts, device_id, kind, {event.param: event.value for event in events}
+        return
+    skipped = 0
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            message = json.loads(record["payload"]) if record["payload"] else {}
+            topic_parts = record["topic"].split("/")
+            if "updates" in message:
+                # A batched message from PublishBatcher
+                for update in message["updates"]:
+                    yield record["time"], update["id"], update["method"], update["contents"]
+            elif len(topic_parts) == 4 and topic_parts[3] in ("action", "update"):
+                yield record["time"], topic_parts[2], topic_parts[3], message.get("contents", {})
+            else:
+                skipped += 1
+    if skipped:
+        logger.warning(f"Skipped {skipped} records that aren't device messages")
+
+
+def replay_speed(value: str) -> float | None:
+    """
+    Parses --speed: a positive multiplier, or max, which is None.
+    """
+    if value == "max":
+        return None
+    try:
+        speed = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number or max, got {value!r}") from None
+    if not speed > 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return speed
+
+
+def positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got {value!r}") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+
+def positive_float(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a number, got {value!r}") from None
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+
+class InflightWindow:
+    """
+    Bounds the number of messages handed to the client that the broker hasn't acknowledged yet,
+    so a fast reader can't queue up the whole trace in the client.
+    """
+
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError(f"In-flight window must be at least 1, got {size} instead.")
+        self.size = size
+        self._inflight = 0
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return self._inflight
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._inflight >= self.size:
+                self._condition.wait()
+            self._inflight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self._inflight = max(0, self._inflight - 1)
+            self._condition.notify()
+
+    def drain(self, timeout: float) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self._inflight == 0, timeout)
+
+
+class Replayer:
+    """
+    Publishes recorded messages, keeping the time between them scaled by speed, and never exceeding rate
+    messages per second. A speed of None sends messages as fast as the rate and in-flight window allow.
+    Messages are pipelined, with at most inflight of them unacknowledged at once.
+    """
+
+    def __init__(
+            self,
+            client: paho.Client,
+            sender_id: str,
+            qos: int = 1,
+            speed: float | None = 1.0,
+            rate: float | None = None,
+            inflight: int = 100,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        if speed is not None and not speed > 0:
+            raise ValueError(f"Replay speed must be positive, got {speed} instead.")
+        if rate is not None and not rate > 0:
+            raise ValueError(f"Replay rate must be positive, got {rate} instead.")
+        self._client = client
+        self._properties = sender_properties(sender_id)
+        self._qos = qos
+        self._speed = speed
+        self._interval = 1 / rate if rate is not None else 0.0
+        self.window = InflightWindow(inflight)
+        self._clock = clock
+        self._sleep = sleep
+        self.sent = 0
+        # paho calls on_publish once a message is acknowledged, or written for QoS 0
+        client.on_publish = self._on_publish
+
+    def run(self, messages: Iterable[Message]) -> int:
+        """
+        Publishes every message, and returns how many were sent.
+        """
+        start = self._clock()
+        first_ts = None
+        next_report = start + REPORT_INTERVAL
+        for ts, device_id, kind, contents in messages:
+            if first_ts is None:
+                first_ts = ts
+            send_time = start + self.sent * self._interval
+            if self._speed is not None:
+                send_time = max(send_time, start + (ts - first_ts) / self._speed)
+            delay = send_time - self._clock()
+            if delay > 0:
+                self._sleep(delay)
+            self.window.acquire()
+            info = self._client.publish(
+                message_topic(device_id, kind), message_payload(contents), qos=self._qos, properties=self._properties
+            )
+            if self._qos == 0 and info.rc != paho.MQTT_ERR_SUCCESS:
+                # Dropped while disconnected, paho won't report it as published
+                self.window.release()
+            self.sent += 1
+            now = self._clock()
+            if now >= next_report:
+                next_report += REPORT_INTERVAL
+                logger.info(f"Sent {self.sent} messages, {self.sent / (now - start):.0f}/s, "
+                            f"{len(self.window)} in flight")
+        return self.sent
+
+    def _on_publish(self, _client, _userdata, _mid, _reason_code, _properties) -> None:
+        self.window.release()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="trace file written by the simulator")
+    parser.add_argument(
+        "--speed", type=replay_speed, default="1", help="speed multiplier of the recorded timing, or max to ignore it"
+    )
+    parser.add_argument("--rate", type=positive_float, help="maximum messages per second")
+    parser.add_argument("--inflight", type=positive_int, default=100, help="maximum unacknowledged messages")
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1, 2))
+    args = parser.parse_args()
+    logging.basicConfig(format="[%(asctime)s] %(levelname)s in %(module)s: %(message)s", level=logging.INFO)
+
+    client_id = f"simulator-replay-{os.getenv('HOSTNAME')}"
+    client = paho.Client(paho.CallbackAPIVersion.VERSION2, protocol=paho.MQTTv5, client_id=client_id)
+    # Let the window decide how many messages are in flight
+    client.max_inflight_messages_set(args.inflight)
+    connected = threading.Event()
+    client.on_connect = lambda *_: connected.set()
+    client.connect_async(BROKER_HOST, BROKER_PORT, 60)
+    client.loop_start()
+    if not connected.wait(30):
+        logger.error(f"Failed to connect to {BROKER_HOST}:{BROKER_PORT}")
+        client.loop_stop()
+        raise SystemExit(1)
+
+    replayer = Replayer(
+        client,
+        sender_id=client_id,
+        qos=args.qos,
+        speed=args.speed,
+        rate=args.rate,
+        inflight=args.inflight,
+    )
+    start = time.perf_counter()
+    sent = replayer.run(read_messages(args.trace))
+    if not replayer.window.drain(timeout=60):
+        logger.warning(f"{len(replayer.window)} messages were still unacknowledged when giving up")
+    elapsed = time.perf_counter() - start
+    logger.info(f"Replayed {sent} messages in {elapsed:.2f}s, {sent / elapsed if elapsed else 0:.0f}/s")
+    client.disconnect()
+    client.loop_stop()
+
+
+if __name__ == "__main__":
+    main()
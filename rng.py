@@ -0,0 +1,85 @@
+import hashlib
+import secrets
+from typing import TYPE_CHECKING, Sequence, TypeVar
+
+if TYPE_CHECKING:
+    import numpy as np
+
+T = TypeVar("T")
+
+MASK_64 = (1 << 64) - 1
+
+
+def derive_seed(seed: int, key: str) -> int:
+    """
+    Derives an independent 64-bit seed for the given key. Unlike hash(), it's the same in every process and run.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8, key=(seed & MASK_64).to_bytes(8, "big"))
+    return int.from_bytes(digest.digest(), "big")
+
+
+class RandomStream:
+    """
+    A small SplitMix64 generator, cheap enough to give every device its own.
+    Implements the subset of random.Random the devices use. Its whole state is one slot, so a class can also
+    inherit it and be its own stream, which saves a separate object per instance.
+    """
+    __slots__ = ("_random_state",)
+
+    def __init__(self, seed: int):
+        self._random_state = seed & MASK_64
+
+    def next_bits(self) -> int:
+        self._random_state = state = (self._random_state + 0x9E3779B97F4A7C15) & MASK_64
+        state = ((state ^ (state >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        state = ((state ^ (state >> 27)) * 0x94D049BB133111EB) & MASK_64
+        return state ^ (state >> 31)
+
+    def random(self) -> float:
+        return (self.next_bits() >> 11) * (1.0 / (1 << 53))
+
+    def randbelow(self, n: int) -> int:
+        if not 0 < n <= MASK_64:
+            raise ValueError(f"Can't draw below {n}")
+        shift = 64 - n.bit_length()
+        while True:
+            # Rejection sampling keeps every value equally likely
+            value = self.next_bits() >> shift
+            if value < n:
+                return value
+
+    def randrange(self, start: int, stop: int | None = None) -> int:
+        if stop is None:
+            start, stop = 0, start
+        return start + self.randbelow(stop - start)
+
+    def randint(self, a: int, b: int) -> int:
+        return a + self.randbelow(b - a + 1)
+
+    def choice(self, sequence: Sequence[T]) -> T:
+        return sequence[self.randbelow(len(sequence))]
+
+
+class SimulationRandom:
+    """
+    Source of every random decision in the simulation. Each device gets its own stream derived from the
+    global seed and its id, so a device behaves the same regardless of which other devices exist or in
+    what order they're ticked, and a run can be reproduced by reusing its seed.
+    """
+
+    def __init__(self, seed: int | None = None):
+        self.seed = seed if seed is not None else secrets.randbits(63)
+
+    def seed_for(self, key: str) -> int:
+        return derive_seed(self.seed, key)
+
+    def stream(self, key: str) -> RandomStream:
+        return RandomStream(self.seed_for(key))
+
+    def generator(self, key: str) -> "np.random.Generator":
+        """
+        A NumPy generator for drawing many values in one batch.
+        """
+        import numpy as np
+
+        return np.random.default_rng(derive_seed(self.seed, key))
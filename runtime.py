@@ -0,0 +1,62 @@
+import logging
+
+import paho.mqtt.client as paho
+
+from client_pool import ClientPool
+from clock import SimulationClock
+from outbound import OutboundQueue
+from publish_batcher import PublishBatcher
+from publish_filter import PublishFilter
+from rng import SimulationRandom
+from serialization import JSON, Codec, sender_properties
+
+
+class RuntimeContext:
+    """
+    Dependencies shared by every device, so each device holds a single reference instead of its own copies.
+    """
+    __slots__ = (
+        "mqtt_client", "logger", "sender_id", "qos", "publish_filter", "publish_batcher", "rng", "clock", "codec",
+        "properties", "outbound",
+    )
+
+    def __init__(
+            self,
+            mqtt_client: paho.Client,
+            logger: logging.Logger,
+            sender_id: str,
+            qos: int = 2,
+            publish_filter: PublishFilter | None = None,
+            publish_batcher: PublishBatcher | None = None,
+            rng: SimulationRandom | None = None,
+            clock: SimulationClock | None = None,
+            codec: Codec = JSON,
+            outbound: OutboundQueue | ClientPool | None = None,
+    ):
+        self.mqtt_client = mqtt_client
+        self.logger = logger
+        self.sender_id = sender_id
+        # QoS of messages published on the per-device topics
+        self.qos = qos
+        # Drops publishes of values that haven't changed meaningfully
+        self.publish_filter = publish_filter
+        # Collects updates into one message per tick
+        self.publish_batcher = publish_batcher
+        # Every device draws from its own stream of this
+        self.rng = rng if rng is not None else SimulationRandom()
+        # Time as seen by the devices
+        self.clock = clock if clock is not None else SimulationClock()
+        # Encodes payloads on the per-device topics
+        self.codec = codec
+        # Sent with every message, built once since they never change
+        self.properties = sender_properties(sender_id, codec.content_type)
+        # Holds messages while the broker can't take them, mqtt_client publishes through it when set. A client pool
+        # holds them per connection
+        self.outbound = outbound
+
+    @property
+    def changes_paused(self) -> bool:
+        """
+        Whether random changes are paused until a backlog of messages has been sent.
+        """
+        return self.outbound is not None and self.outbound.paused
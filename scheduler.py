@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+# What to do with ticks whose slot has already passed when the previous tick finishes
+POLICIES = ("skip", "catch_up")
+
+
+class TickScheduler:
+    """
+    Calls a tick function at a fixed rate against a monotonic clock, so the time ticks take doesn't add up
+    into drift.
+    The interval can be divided into slices, with the tick function called once per slice with the slice's index,
+    so devices can be spread across the interval instead of all publishing at once.
+    """
+
+    def __init__(
+            self,
+            interval: float = 2,
+            policy: str = "skip",
+            slices: int = 1,
+            logger: logging.Logger | None = None,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+            sleep_async: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        if interval <= 0:
+            raise ValueError(f"Tick interval must be positive, got {interval} instead.")
+        if policy not in POLICIES:
+            raise ValueError(f"Tick policy must be one of {POLICIES}, got {policy} instead.")
+        if slices < 1:
+            raise ValueError(f"Number of slices must be at least 1, got {slices} instead.")
+        self.interval = interval
+        self.policy = policy
+        self.slices = slices
+        self._slot = interval / slices
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._clock = clock
+        self._sleep = sleep
+        self._sleep_async = sleep_async
+        self._end_time: float | None = None
+        self._running = False
+        self._slice_index = 0
+        self._next_time = 0.0
+        # Metrics
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "mean_duration": self.total_duration / self.ticks if self.ticks else 0.0,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+    def stop(self) -> None:
+        self._running = False
+
+    def run(self, tick: Callable[[int], None], duration: float | None = None) -> None:
+        """
+        Calls tick(slice_index) once per slot until stop() is called, or until duration seconds have passed
+        on the scheduler's clock.
+        """
+        self._start(duration)
+        while self._running and not self._finished():
+            delay = self._next_time - self._clock()
+            if delay > 0:
+                self._sleep(delay)
+            self._tick_once(tick)
+
+    async def run_async(self, tick: Callable[[int], None], duration: float | None = None) -> None:
+        """
+        Same as run(), but waits between ticks without blocking the running event loop.
+        """
+        self._start(duration)
+        while self._running and not self._finished():
+            # Always yield, so the event loop can handle messages even when ticks are overrunning
+            await self._sleep_async(max(0.0, self._next_time - self._clock()))
+            self._tick_once(tick)
+
+    def _start(self, duration: float | None) -> None:
+        self._running = True
+        self._slice_index = 0
+        start = self._clock()
+        self._next_time = start + self._slot
+        self._end_time = start + duration if duration is not None else None
+
+    def _finished(self) -> bool:
+        return self._end_time is not None and self._next_time > self._end_time
+
+    def _tick_once(self, tick: Callable[[int], None]) -> None:
+        now = self._clock()
+        self.last_lag = now - self._next_time
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+        tick(self._slice_index)
+        finished = self._clock()
+
+        self.last_duration = finished - now
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.total_duration += self.last_duration
+        self.ticks += 1
+        self._slice_index = (self._slice_index + 1) % self.slices
+        self._next_time += self._slot
+        if finished > self._next_time:
+            self.overruns += 1
+            self._logger.warning(
+                f"Tick took {self.last_duration:.3f}s, overrunning its {self._slot:.3f}s slot "
+                f"by {finished - self._next_time:.3f}s"
+            )
+            if self.policy == "skip":
+                missed = int((finished - self._next_time) // self._slot) + 1
+                self.skipped += missed
+                self._slice_index = (self._slice_index + missed) % self.slices
+                self._next_time += missed * self._slot
@@ -0,0 +1,112 @@
+import functools
+import json
+from typing import Any, Callable, NamedTuple
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+JSON_TYPE = "application/json"
+# Payload formats by the MQTT 5 content type that identifies them, and the package each one needs
+FORMATS: dict[str, tuple[str, str | None]] = {
+    "json": (JSON_TYPE, None),
+    "msgpack": ("application/msgpack", "msgpack"),
+    "cbor": ("application/cbor", "cbor2"),
+}
+
+
+class Codec(NamedTuple):
+    name: str
+    content_type: str
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+
+def json_codec() -> Codec:
+    """
+    Returns the fastest JSON implementation installed: orjson, then msgspec, then the standard library.
+    """
+    try:
+        import orjson
+        return Codec("json", JSON_TYPE, orjson.dumps, orjson.loads)
+    except ImportError:
+        pass
+    try:
+        import msgspec
+        return Codec("json", JSON_TYPE, msgspec.json.encode, msgspec.json.decode)
+    except ImportError:
+        pass
+    return Codec("json", JSON_TYPE, lambda value: json.dumps(value, separators=(",", ":")).encode(), json.loads)
+
+
+JSON = json_codec()
+
+
+@functools.cache
+def codec(name: str) -> Codec:
+    """
+    Returns the codec of a payload format, raising ValueError if it's unknown or its package isn't installed.
+    """
+    if name not in FORMATS:
+        raise ValueError(f"Payload format must be one of {tuple(FORMATS)}, got {name} instead.")
+    match name:
+        case "json":
+            return JSON
+        case "msgpack":
+            try:
+                import msgpack
+            except ImportError:
+                raise ValueError("The msgpack payload format requires the msgpack package") from None
+            return Codec(name, FORMATS[name][0], msgpack.packb, msgpack.unpackb)
+        case _:
+            try:
+                import cbor2
+            except ImportError:
+                raise ValueError("The cbor payload format requires the cbor2 package") from None
+            return Codec(name, FORMATS[name][0], cbor2.dumps, cbor2.loads)
+
+
+CONTENT_TYPES = {content_type: name for name, (content_type, _) in FORMATS.items()}
+
+
+def content_codec(content_type: str | None) -> Codec:
+    """
+    Returns the codec of the format a content type names, JSON when there's none.
+    """
+    if content_type is None or content_type == JSON_TYPE:
+        return JSON
+    if content_type not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported content type {content_type}")
+    return codec(CONTENT_TYPES[content_type])
+
+
+def decode(payload: bytes, content_type: str | None = None) -> Any:
+    return content_codec(content_type).decode(payload)
+
+
+class PackedProperties(Properties):
+    """
+    Properties that are packed once instead of on every publish. Setting a property packs them again.
+    """
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        object.__setattr__(self, "_packed", None)
+
+    def pack(self) -> bytes:
+        packed = self.__dict__.get("_packed")
+        if packed is None:
+            packed = super().pack()
+            object.__setattr__(self, "_packed", packed)
+        return packed
+
+
+def sender_properties(sender_id: str, content_type: str | None = None) -> Properties:
+    """
+    Properties identifying the sender of a message, so instances can ignore their own messages, and the format of
+    its payload when it isn't JSON. Build them once and reuse them for every message.
+    """
+    properties = PackedProperties(PacketTypes.PUBLISH)
+    properties.UserProperty = [("sender_id", sender_id)]
+    if content_type is not None and content_type != JSON_TYPE:
+        properties.ContentType = content_type
+    return properties
@@ -0,0 +1,116 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+import time
+from typing import Any, Callable, Hashable, Iterable
+
+# Points each node gets on the ring, more points spread devices more evenly
+VIRTUAL_NODES = 100
+# Seconds between aggregated metrics log lines
+REPORT_INTERVAL = 30
+
+
+def stable_hash(key: str) -> int:
+    """
+    A hash that, unlike hash(), is the same in every process.
+    """
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of device ids onto a set of nodes, so adding or removing a node only moves
+    the devices that belonged to it.
+    """
+
+    def __init__(self, nodes: Iterable[Hashable], virtual_nodes: int = VIRTUAL_NODES):
+        points = sorted(
+            (stable_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(virtual_nodes)
+        )
+        if not points:
+            raise ValueError("A hash ring needs at least one node")
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> Hashable:
+        index = bisect.bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class Supervisor:
+    """
+    Splits the device list across worker processes and aggregates the metrics they report.
+    Each worker is called as worker(shard, shards, devices, metrics_queue), and is expected to put dicts
+    of numeric metrics on the queue from time to time.
+    """
+
+    def __init__(
+            self,
+            shards: int,
+            worker: Callable[[int, int, list[dict], Any], None],
+            logger: logging.Logger,
+            report_interval: float = REPORT_INTERVAL,
+    ):
+        if shards < 1:
+            raise ValueError(f"Number of shards must be at least 1, got {shards} instead.")
+        self._shards = shards
+        self._worker = worker
+        self._logger = logger
+        self._report_interval = report_interval
+        self._ring = HashRing(range(shards))
+        self.metrics: dict[int, dict] = {}
+
+    def partition(self, device_list: list[dict]) -> list[list[dict]]:
+        assignments: list[list[dict]] = [[] for _ in range(self._shards)]
+        for device_data in device_list:
+            assignments[self._ring.owner(device_data["id"])].append(device_data)
+        return assignments
+
+    def aggregate(self) -> dict:
+        totals: dict[str, float] = {}
+        for shard_metrics in self.metrics.values():
+            for key, value in shard_metrics.items():
+                if key != "shard":
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def run(self, device_list: list[dict]) -> int:
+        """
+        Starts the workers and supervises them. Returns an exit code once one of them dies.
+        """
+        context = multiprocessing.get_context("spawn")
+        metrics_queue = context.Queue()
+        processes = []
+        for shard, shard_devices in enumerate(self.partition(device_list)):
+            self._logger.info(f"Starting shard {shard} with {len(shard_devices)} devices")
+            process = context.Process(
+                target=self._worker,
+                args=(shard, self._shards, shard_devices, metrics_queue),
+                name=f"simulator-shard-{shard}",
+            )
+            process.start()
+            processes.append(process)
+
+        next_report = time.monotonic() + self._report_interval
+        try:
+            while all(process.is_alive() for process in processes):
+                try:
+                    shard_metrics = metrics_queue.get(timeout=1)
+                    self.metrics[shard_metrics["shard"]] = shard_metrics
+                except queue.Empty:
+                    pass
+                if time.monotonic() >= next_report:
+                    next_report += self._report_interval
+                    self._logger.info(f"Metrics across {len(self.metrics)} shards: {self.aggregate()}")
+            for process in processes:
+                if not process.is_alive():
+                    self._logger.error(f"Shard process {process.name} exited with code {process.exitcode}")
+            return 1
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable
+
+from device import Device
+
+SNAPSHOT_VERSION = 1
+# Devices serialized between two yields of the GIL to the tick loop
+YIELD_EVERY = 1000
+
+
+def load_snapshot(path: str) -> tuple[list[dict], str | None]:
+    """
+    Reads a snapshot written by SnapshotWriter, or a plain list of devices in the backend's format such as data.json.
+    Returns the devices and the backend ETag the snapshot was taken against, if known.
+    """
+    with open(path) as file:
+        data = json.load(file)
+    if isinstance(data, list):
+        return data, None
+    if data.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {data.get('version')}")
+    return data["devices"], data.get("etag")
+
+
+class SnapshotWriter:
+    """
+    Periodically writes the full state of every device to a local file from a background thread.
+    Files are written atomically, so a crash mid-write leaves the previous snapshot intact.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            devices: Iterable[Device],
+            interval: float,
+            logger: logging.Logger,
+            etag: Callable[[], str | None] = lambda: None,
+    ):
+        if not interval > 0:
+            raise ValueError(f"Snapshot interval must be positive, got {interval} instead.")
+        self._path = path
+        self._devices = devices
+        self._interval = interval
+        self._logger = logger
+        self._etag = etag
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def write(self) -> None:
+        start = time.perf_counter()
+        records = []
+        for index, device in enumerate(self._devices):
+            records.append(device.to_dict())
+            if index % YIELD_EVERY == YIELD_EVERY - 1:
+                # Let the tick loop run, serializing a large fleet shouldn't delay ticks
+                time.sleep(0)
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "etag": self._etag(),
+            "devices": records,
+        }
+        with self._write_lock:
+            temporary_path = self._path + ".tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(snapshot, file, separators=(",", ":"))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, self._path)
+        self._logger.info(f"Saved snapshot of {len(records)} devices in {time.perf_counter() - start:.2f}s")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                self.write()
+            except (OSError, ValueError):
+                self._logger.exception("Failed to save snapshot")
@@ -0,0 +1,106 @@
+import logging
+import threading
+
+import paho.mqtt.client as paho
+from paho.mqtt.subscribeoptions import SubscribeOptions
+
+TOPIC_PREFIX = "project/home"
+# New devices can be created by any instance, so every instance listens for posts
+CONTROL_TOPIC = f"{TOPIC_PREFIX}/+/post"
+# Topics per SUBSCRIBE/UNSUBSCRIBE packet, keeps packets well below broker size limits
+MAX_TOPICS_PER_PACKET = 500
+
+
+def device_topic(device_id: str) -> str:
+    return f"{TOPIC_PREFIX}/{device_id}/+"
+
+
+class SubscriptionManager:
+    """
+    Keeps the client subscribed only to the topics of the devices this instance simulates, plus the control topic.
+    Changes are collected and sent in batches by flush(), and everything is re-subscribed on reconnect.
+    Subscriptions use no_local, so the broker never sends the client the messages it published. Messages published
+    by other clients of the same instance can still arrive, so they're recognized by their sender_id instead.
+    Without control, only device topics are subscribed to, for when another client subscribes to the rest.
+    Shared subscriptions in control_topics are made without no_local, which MQTT doesn't allow on them.
+    """
+
+    def __init__(
+            self,
+            client: paho.Client,
+            logger: logging.Logger,
+            qos: int = 0,
+            per_device: bool = True,
+            control: bool = True,
+            control_topics: tuple[str, ...] = (CONTROL_TOPIC,),
+    ):
+        self._client = client
+        self._control = control
+        self._control_topics = control_topics
+        self._logger = logger
+        self._options = SubscribeOptions(qos=qos, noLocal=True)
+        self._shared_options = SubscribeOptions(qos=qos)
+        self._per_device = per_device
+        self._topics: set[str] = set()
+        self._to_subscribe: set[str] = set()
+        self._to_unsubscribe: set[str] = set()
+        self._connected = False
+        self._lock = threading.Lock()
+
+    def add_device(self, device_id: str) -> None:
+        if not self._per_device:
+            return
+        if any(char in device_id for char in "+#/"):
+            self._logger.error(f"Can't subscribe to device ID {device_id}, it contains topic wildcards or separators")
+            return
+        topic = device_topic(device_id)
+        with self._lock:
+            self._topics.add(topic)
+            self._to_unsubscribe.discard(topic)
+            self._to_subscribe.add(topic)
+
+    def remove_device(self, device_id: str) -> None:
+        if not self._per_device:
+            return
+        topic = device_topic(device_id)
+        with self._lock:
+            if topic not in self._topics:
+                return
+            self._topics.discard(topic)
+            self._to_subscribe.discard(topic)
+            self._to_unsubscribe.add(topic)
+
+    def on_connect(self) -> None:
+        """
+        Subscribes to every topic from scratch, since a new session may not remember earlier subscriptions.
+        """
+        with self._lock:
+            self._connected = True
+            self._to_subscribe.clear()
+            self._to_unsubscribe.clear()
+            if self._per_device:
+                topics = [*self._control_topics, *self._topics] if self._control else list(self._topics)
+            else:
+                topics = [f"{TOPIC_PREFIX}/#"] if self._control else []
+        self._subscribe(topics)
+
+    def on_disconnect(self) -> None:
+        with self._lock:
+            self._connected = False
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._connected or not (self._to_subscribe or self._to_unsubscribe):
+                return
+            to_subscribe, self._to_subscribe = list(self._to_subscribe), set()
+            to_unsubscribe, self._to_unsubscribe = list(self._to_unsubscribe), set()
+        self._subscribe(to_subscribe)
+        for start in range(0, len(to_unsubscribe), MAX_TOPICS_PER_PACKET):
+            self._client.unsubscribe(to_unsubscribe[start:start + MAX_TOPICS_PER_PACKET])
+
+    def _subscribe(self, topics: list[str]) -> None:
+        for start in range(0, len(topics), MAX_TOPICS_PER_PACKET):
+            self._client.subscribe([
+                (topic, self._shared_options if topic.startswith("$share/") else self._options)
+                for topic in topics[start:start + MAX_TOPICS_PER_PACKET]
+            ])
@@ -0,0 +1,44 @@
+import logging
+
+import paho.mqtt.client as paho
+
+from light import Light
+from publish_batcher import DEFAULT_TOPIC, PublishBatcher
+from runtime import RuntimeContext
+from serialization import JSON
+
+
+class RecordingClient(paho.Client):
+    """
+    A disconnected paho client, which still checks topics before publishing.
+    """
+
+    def __init__(self):
+        super().__init__(paho.CallbackAPIVersion.VERSION2, protocol=paho.MQTTv5)
+        self.published: list[tuple[str, dict]] = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        info = super().publish(topic, payload, qos, retain, properties)
+        self.published.append((topic, JSON.decode(payload)))
+        return info
+
+
+def test_room_batches_escape_topic_characters():
+    client = RecordingClient()
+    context = RuntimeContext(mqtt_client=client, logger=logging.getLogger(__name__), sender_id="test")
+    batcher = PublishBatcher(client, sender_id="test", group_by="room")
+    rooms = ["Room #2", "Room +2", "Attic/Loft", "100% Kitchen", "Living Room"]
+    for index, room in enumerate(rooms):
+        batcher.add(Light(f"light-{index}", room, "Light", context), {"brightness": 1}, {})
+
+    batcher.flush()
+
+    topics = [topic for topic, _ in client.published]
+    assert topics == [
+        f"{DEFAULT_TOPIC}/Room %232",
+        f"{DEFAULT_TOPIC}/Room %2B2",
+        f"{DEFAULT_TOPIC}/Attic%2FLoft",
+        f"{DEFAULT_TOPIC}/100%25 Kitchen",
+        f"{DEFAULT_TOPIC}/Living Room",
+    ]
+    assert [payload["updates"][0]["id"] for _, payload in client.published] == [f"light-{i}" for i in range(5)]
@@ -0,0 +1,49 @@
+from publish_filter import PublishFilter, PublishRule
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_change_within_min_interval_is_published_once_it_expires():
+    clock = FakeClock()
+    publish_filter = PublishFilter({"temperature": PublishRule(min_interval=10)}, clock=clock)
+    assert publish_filter.filter("d1", {"temperature": 20}) == {"temperature": 20}
+    clock.now = 2
+    assert publish_filter.filter("d1", {"temperature": 21}) == {}
+    clock.now = 4
+    assert publish_filter.filter("d1", {"temperature": 22}) == {}
+    clock.now = 9
+    assert publish_filter.due() == []
+    clock.now = 10
+    ((device_id, action_parameters, update_parameters),) = publish_filter.due()
+    assert (device_id, action_parameters, update_parameters) == ("d1", {}, {"temperature": 22})
+    assert publish_filter.filter(device_id, update_parameters) == {"temperature": 22}
+    assert publish_filter.due() == []
+    assert (publish_filter.sent, publish_filter.suppressed) == (2, 1)
+
+
+def test_held_value_is_dropped_when_a_later_change_is_published():
+    clock = FakeClock()
+    publish_filter = PublishFilter({"status": PublishRule(min_interval=10)}, clock=clock)
+    publish_filter.filter("d1", {"status": "off"}, "action")
+    clock.now = 5
+    assert publish_filter.filter("d1", {"status": "on"}, "action") == {}
+    clock.now = 12
+    assert publish_filter.filter("d1", {"status": "off"}, "action") == {}
+    assert publish_filter.due() == []
+
+
+def test_forget_drops_held_values():
+    clock = FakeClock()
+    publish_filter = PublishFilter({"status": PublishRule(min_interval=10)}, clock=clock)
+    publish_filter.filter("d1", {"status": "off"}, "action")
+    clock.now = 5
+    publish_filter.filter("d1", {"status": "on"}, "action")
+    publish_filter.forget("d1")
+    clock.now = 20
+    assert publish_filter.due() == []
@@ -0,0 +1,249 @@
+import threading
+from typing import Callable
+
+import numpy as np
+
+from clock import SimulationClock
+from columns import Column, columns_of
+from curtain import Curtain, MIN_POSITION, MAX_POSITION, POSITION_RATE
+from device import Device, CHANCE_TO_CHANGE
+from door_lock import DoorLock, MIN_BATTERY, MAX_BATTERY, BATTERY_DRAIN
+from rng import SimulationRandom
+from water_heater import WaterHeater, Phase, ROOM_TEMPERATURE, HEATING_RATE, SECONDS_PER_DAY
+
+DTYPES: dict[type, type] = {
+    int: np.int64,
+    float: np.float64,
+    bool: np.bool_,
+}
+INITIAL_CAPACITY = 64
+
+# Each step returns the parameters it changed, as (topic kind, parameter name, mask of changed rows)
+Changes = list[tuple[str, str, np.ndarray]]
+
+
+class ColumnStore:
+    """
+    Structure-of-arrays storage for the numeric state of every attached device of a single class.
+    """
+
+    def __init__(self, device_class: type[Device]):
+        self.device_class = device_class
+        self.fields: dict[str, Column] = columns_of(device_class)
+        self.capacity = INITIAL_CAPACITY
+        self.columns: dict[str, np.ndarray] = {
+            name: np.empty(INITIAL_CAPACITY, dtype=DTYPES[column.dtype]) for name, column in self.fields.items()
+        }
+        self.devices: list[Device] = []
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    def view(self, name: str) -> np.ndarray:
+        return self.columns[name][:len(self.devices)]
+
+    def attach(self, device: Device) -> None:
+        row = len(self.devices)
+        if row == self.capacity:
+            self._grow()
+        for name, column in self.fields.items():
+            self.columns[name][row] = column.slot.__get__(device)
+        self.devices.append(device)
+        device._row = row
+        device._store = self
+
+    def detach(self, device: Device) -> None:
+        row = device._row
+        device._store = None
+        for name, column in self.fields.items():
+            column.slot.__set__(device, column.dtype(self.columns[name][row]))
+        # Fill the hole with the last row so the arrays stay dense
+        last = len(self.devices) - 1
+        if row != last:
+            for array in self.columns.values():
+                array[row] = array[last]
+            moved = self.devices[last]
+            self.devices[row] = moved
+            moved._row = row
+        self.devices.pop()
+
+    def _grow(self) -> None:
+        self.capacity *= 2
+        for name, array in self.columns.items():
+            grown = np.empty(self.capacity, dtype=array.dtype)
+            grown[:len(array)] = array
+            self.columns[name] = grown
+
+
+def step_water_heaters(store: ColumnStore, now: float) -> Changes:
+    """
+    Batched equivalent of WaterHeater.advance
+    """
+    status = store.view("_status")
+    target_temperature = store.view("_target_temperature")
+    reported_temperature = store.view("_temperature")
+    phase = store.view("_phase")
+    anchor_temperature = store.view("_anchor_temperature")
+    anchor_time = store.view("_anchor_time")
+    was_heating = phase == Phase.HEATING
+
+    def floor_temperature() -> np.ndarray:
+        return np.where(status == 1, target_temperature, ROOM_TEMPERATURE).astype(np.float64)
+
+    def temperature_at() -> np.ndarray:
+        floor = floor_temperature()
+        heating = np.minimum(target_temperature, anchor_temperature + HEATING_RATE * (now - anchor_time))
+        cooling = np.where(
+            anchor_temperature <= floor,
+            anchor_temperature,
+            np.maximum(floor, anchor_temperature - HEATING_RATE * (now - anchor_time)),
+        )
+        return np.where(phase == Phase.HEATING, heating, np.where(phase == Phase.COOLING, cooling, anchor_temperature))
+
+    def anchor(rows: np.ndarray) -> None:
+        anchor_temperature[rows] = temperature_at()[rows]
+        anchor_time[rows] = now
+
+    def start_next_phase(rows: np.ndarray) -> None:
+        on = status == 1
+        next_phase = np.where(
+            on & (anchor_temperature < target_temperature),
+            Phase.HEATING,
+            np.where(on & (anchor_temperature == target_temperature), Phase.HOLDING, Phase.COOLING),
+        )
+        phase[rows] = next_phase[rows]
+
+    # Adjusting status
+    turned_on = np.zeros(len(store), dtype=np.bool_)
+    turned_off = np.zeros(len(store), dtype=np.bool_)
+    timer_enabled = store.view("_timer_enabled")
+    if timer_enabled.any():
+        next_on = store.view("_next_on")
+        next_off = store.view("_next_off")
+        fired_on = timer_enabled & (now >= next_on)
+        fired_off = timer_enabled & (now >= next_off)
+        next_on[fired_on] += SECONDS_PER_DAY * (np.floor((now - next_on[fired_on]) / SECONDS_PER_DAY) + 1)
+        next_off[fired_off] += SECONDS_PER_DAY * (np.floor((now - next_off[fired_off]) / SECONDS_PER_DAY) + 1)
+        turned_on = fired_on & (status == 0)
+        turned_off = fired_off & (status == 1)
+        # The temperature is anchored under the old status, before it changes
+        switched = turned_on | turned_off
+        anchor(switched)
+        status[turned_on] = 1
+        status[turned_off] = 0
+        start_next_phase(switched)
+    # Starting the next phase of heaters whose phase reached its target
+    floor = floor_temperature()
+    phase_end = np.where(
+        phase == Phase.HEATING,
+        anchor_time + (target_temperature - anchor_temperature) / HEATING_RATE,
+        np.where(
+            (phase == Phase.COOLING) & (anchor_temperature > floor),
+            anchor_time + (anchor_temperature - floor) / HEATING_RATE,
+            np.inf,
+        ),
+    )
+    ended = now >= phase_end
+    anchor(ended)
+    start_next_phase(ended)
+    # Adjusting the reported temperature
+    temperature = np.round(temperature_at()).astype(np.int64)
+    temperature_changed = temperature != reported_temperature
+    reported_temperature[temperature_changed] = temperature[temperature_changed]
+    return [
+        ("update", "status", turned_on | turned_off),
+        ("action", "temperature", temperature_changed),
+        ("action", "is_heating", (phase == Phase.HEATING) != was_heating),
+    ]
+
+
+def step_curtains(store: ColumnStore, _now: float) -> Changes:
+    """
+    Batched equivalent of Curtain.advance
+    """
+    position = store.view("_position")
+    is_open = store.view("_status") == 0
+    opening = is_open & (position > MIN_POSITION)
+    closing = ~is_open & (position < MAX_POSITION)
+    position[opening] -= POSITION_RATE
+    position[closing] += POSITION_RATE
+    return [("action", "position", opening | closing)]
+
+
+def step_door_locks(store: ColumnStore, _now: float) -> Changes:
+    """
+    Batched equivalent of DoorLock.advance
+    """
+    battery_level = store.view("_battery_level")
+    battery_level -= BATTERY_DRAIN
+    battery_level[battery_level < MIN_BATTERY] = MAX_BATTERY
+    return [("action", "battery_level", np.ones(len(store), dtype=np.bool_))]
+
+
+STEPS: dict[type[Device], Callable[[ColumnStore, float], Changes]] = {
+    WaterHeater: step_water_heaters,
+    Curtain: step_curtains,
+    DoorLock: step_door_locks,
+}
+
+
+class VectorizedTickEngine:
+    """
+    Ticks the whole fleet one device class at a time, using batched NumPy operations instead of calling
+    Device.tick on every device. Only devices whose state changed are published.
+    """
+
+    def __init__(
+            self,
+            rng: SimulationRandom,
+            clock: SimulationClock,
+            changes_paused: Callable[[], bool] = lambda: False,
+    ):
+        self._rng = rng.generator("tick_engine")
+        self._clock = clock
+        self._changes_paused = changes_paused
+        self._stores: dict[type[Device], ColumnStore] = {}
+        self._lock = threading.Lock()
+
+    def attach(self, device: Device) -> None:
+        with self._lock:
+            store = self._stores.get(type(device))
+            if store is None:
+                store = self._stores[type(device)] = ColumnStore(type(device))
+            store.attach(device)
+
+    def detach(self, device: Device) -> None:
+        with self._lock:
+            store = self._stores.get(type(device))
+            if store is not None and device._store is store:
+                store.detach(device)
+
+    def wake(self, device: Device) -> None:
+        """
+        Every device is stepped on every tick, so there's nothing to do when one changes.
+        """
+        pass
+
+    def tick(self) -> None:
+        with self._lock:
+            for device_class, store in self._stores.items():
+                if len(store):
+                    self._tick_store(store, STEPS.get(device_class))
+
+    def _tick_store(self, store: ColumnStore, step: Callable[[ColumnStore, float], Changes] | None) -> None:
+        changes = step(store, self._clock.now()) if step is not None else []
+        action_parameters: dict[int, dict] = {}
+        update_parameters: dict[int, dict] = {}
+        for kind, parameter, changed in changes:
+            parameters = action_parameters if kind == "action" else update_parameters
+            for row in np.flatnonzero(changed).tolist():
+                parameters.setdefault(row, {})[parameter] = getattr(store.devices[row], parameter)
+        # Draw every device's roll at once, and only run the per-device code for the few that hit
+        hits = np.flatnonzero(self._rng.random(len(store)) < CHANCE_TO_CHANGE).tolist()
+        for row in hits if not self._changes_paused() else ():
+            store.devices[row].random_change(
+                action_parameters.setdefault(row, {}),
+                update_parameters.setdefault(row, {}),
+            )
+        for row in sorted(action_parameters.keys() | update_parameters.keys()):
+            store.devices[row].publish_mqtt(action_parameters.get(row, {}), update_parameters.get(row, {}))
@@ -0,0 +1,166 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Any, Callable, Iterator, NamedTuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from serialization import decode
+
+MAGIC = b"SHTRACE1"
+# Codec of every chunk in a file, recorded once after the magic bytes
+CODEC_MSGPACK = b"M"
+CODEC_JSON = b"J"
+# Chunks are prefixed with their compressed length
+LENGTH = struct.Struct(">I")
+COLUMNS = ("ts", "device_id", "kind", "param", "value")
+# Rows buffered before a chunk is written
+CHUNK_ROWS = 10_000
+
+
+class TraceEvent(NamedTuple):
+    ts: float
+    device_id: str
+    kind: str
+    param: str
+    value: Any
+
+
+def _encode(columns: dict[str, list], codec: bytes) -> bytes:
+    if codec == CODEC_MSGPACK:
+        return msgpack.packb(columns, use_bin_type=True)
+    return json.dumps(columns, separators=(",", ":")).encode()
+
+
+def _decode(data: bytes, codec: bytes) -> dict[str, list]:
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("Trace was written with msgpack, which isn't installed")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+class TraceWriter:
+    """
+    Records every published parameter change to an append-only trace file, instead of sending it to a broker.
+    Rows of (ts, device_id, kind, param, value) are buffered and written as zlib-compressed, length-prefixed
+    chunks holding one list per column, encoded with msgpack when it's installed and JSON otherwise.
+    Has the same publish() as a paho client, so it can be used wherever devices expect one.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float], chunk_rows: int = CHUNK_ROWS):
+        self.path = path
+        self._clock = clock
+        self._chunk_rows = chunk_rows
+        self._codec = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+        # Opened on the first message, so a writer that never publishes doesn't touch the file
+        self._file = None
+        self._columns: dict[str, list] = {column: [] for column in COLUMNS}
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.rows = 0
+        self.chunks = 0
+
+    def publish(
+            self,
+            topic: str,
+            payload: bytes | str | None = None,
+            qos: int = 0,
+            retain: bool = False,
+            properties: Any = None,
+    ) -> None:
+        ts = self._clock()
+        message = decode(payload, getattr(properties, "ContentType", None)) if payload else {}
+        topic_parts = topic.split("/")
+        if "updates" in message:
+            # A batched message from PublishBatcher
+            changes = [(update["id"], update["method"], update["contents"]) for update in message["updates"]]
+        elif len(topic_parts) == 4:
+            changes = [(topic_parts[2], topic_parts[3], message.get("contents", {}))]
+        else:
+            return
+        with self._lock:
+            self.messages += 1
+            for device_id, kind, contents in changes:
+                for param, value in contents.items():
+                    self._columns["ts"].append(ts)
+                    self._columns["device_id"].append(device_id)
+                    self._columns["kind"].append(kind)
+                    self._columns["param"].append(param)
+                    self._columns["value"].append(value)
+            if len(self._columns["ts"]) >= self._chunk_rows:
+                self._write_chunk()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._write_chunk()
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_chunk()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self) -> None:
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            # Keep appending to an earlier trace, in the codec it was started with
+            with open(self.path, "rb") as file:
+                header = file.read(len(MAGIC) + 1)
+            if header[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{self.path} is not a trace file")
+            self._codec = header[len(MAGIC):]
+            if self._codec == CODEC_MSGPACK and msgpack is None:
+                raise ValueError(f"{self.path} was written with msgpack, which isn't installed")
+            self._file = open(self.path, "ab")
+        else:
+            self._file = open(self.path, "wb")
+            self._file.write(MAGIC + self._codec)
+
+    def _write_chunk(self) -> None:
+        rows = len(self._columns["ts"])
+        if not rows:
+            return
+        if self._file is None:
+            self._open()
+        data = zlib.compress(_encode(self._columns, self._codec))
+        self._file.write(LENGTH.pack(len(data)) + data)
+        self._columns = {column: [] for column in COLUMNS}
+        self.rows += rows
+        self.chunks += 1
+
+
+def iter_chunks(path: str) -> Iterator[dict[str, list]]:
+    """
+    Yields the columns of every chunk in a trace file, reading one chunk at a time.
+    A chunk cut short by a crash mid-write ends the trace.
+    """
+    with open(path, "rb") as file:
+        header = file.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        codec = header[len(MAGIC):]
+        while True:
+            prefix = file.read(LENGTH.size)
+            if len(prefix) < LENGTH.size:
+                return
+            length = LENGTH.unpack(prefix)[0]
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield _decode(zlib.decompress(data), codec)
+
+
+def iter_trace(path: str) -> Iterator[TraceEvent]:
+    """
+    Yields every event in a trace file in the order it was recorded.
+    """
+    for columns in iter_chunks(path):
+        yield from map(TraceEvent, *(columns[column] for column in COLUMNS))
@@ -1,43 +1,105 @@
-import random
-import logging
-from datetime import datetime, time, timedelta
+import math
+from datetime import datetime, time
+from enum import IntEnum
 from typing import override
 
-import paho.mqtt.client as paho
-
-from device import Device, CHANCE_TO_CHANGE, GENERAL_PARAMETERS
+from columns import Column
+from device import Device, Setter
 from device_types import DeviceType
+from runtime import RuntimeContext
 
 # Celsius
 MIN_TEMPERATURE = 49
 MAX_TEMPERATURE = 60
 ROOM_TEMPERATURE = 23
-HEATING_RATE = 1
+# Degrees per second, both heating and cooling
+HEATING_RATE = 0.5
 
 DEFAULT_SCHEDULED_ON = time.fromisoformat("06:30")
 DEFAULT_SCHEDULED_OFF = time.fromisoformat("08:00")
+SECONDS_PER_DAY = 24 * 60 * 60
+# Schedules and temperatures many heaters have in common, such as those of one template, along with the next
+# occurrences of the schedules, so the heaters share one object for each value instead of holding their own
+SHARED_SECONDS: dict[int, int] = {}
+SHARED_FLOATS: dict[float, float] = {}
+MAX_SHARED_VALUES = 4096
+
+
+def parse_time(value: str) -> time:
+    return time.fromisoformat(WaterHeater.fix_time_string(value))
+
+
+class Phase(IntEnum):
+    # Rising towards the target temperature
+    HEATING = 0
+    # Kept exactly at the target temperature
+    HOLDING = 1
+    # Falling towards the target temperature while on, or the room temperature while off
+    COOLING = 2
+
+
+def share(values: dict, value):
+    shared = values.get(value)
+    if shared is None:
+        # Next occurrences move on every day, so the oldest values are dropped now and then
+        if len(values) >= MAX_SHARED_VALUES:
+            values.clear()
+        shared = values[value] = value
+    return shared
+
+
+def seconds_of_day(value: time) -> int:
+    return share(SHARED_SECONDS, value.hour * 3600 + value.minute * 60 + value.second)
 
-PARAMETERS: list[str] = [
-    "target_temperature",
-    "timer_enabled",
-    "scheduled_on",
-    "scheduled_off",
-]
+
+def time_of_day(seconds: int) -> time:
+    seconds = int(seconds)
+    return time(hour=seconds // 3600, minute=seconds // 60 % 60, second=seconds % 60)
+
+
+def next_occurrence(now: float, seconds: int) -> float:
+    """
+    Returns the first time after now at which the local time of day is the given number of seconds since midnight.
+    """
+    midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    occurrence = midnight + seconds
+    return share(SHARED_FLOATS, occurrence if occurrence > now else occurrence + SECONDS_PER_DAY)
 
 
 class WaterHeater(Device):
+    """
+    Temperature follows a closed-form model: the heater remembers the temperature and time it last changed phase,
+    and the current temperature is derived from them whenever it's needed. Work is only done when a phase ends
+    or a timer fires. A heater at rest doesn't need the time it got there, so it keeps none.
+    """
+    # Schedules are stored as seconds since midnight, and their next occurrences as simulated times
+    __slots__ = (
+        "_temperature", "_target_temperature", "_timer_enabled", "_scheduled_on", "_scheduled_off",
+        "_phase", "_anchor_temperature", "_anchor_time", "_next_on", "_next_off",
+    )
+    COLUMNS = {
+        "_status": Column(int),
+        "_temperature": Column(int),
+        "_target_temperature": Column(int),
+        "_timer_enabled": Column(bool),
+        "_scheduled_on": Column(int),
+        "_scheduled_off": Column(int),
+        "_phase": Column(int),
+        "_anchor_temperature": Column(float),
+        "_anchor_time": Column(float),
+        "_next_on": Column(float),
+        "_next_off": Column(float),
+    }
+
     def __init__(
             self,
             device_id: str,
             room: str,
             name: str,
-            sender_id: str,
-            mqtt_client: paho.Client,
-            logger: logging.Logger,
+            context: RuntimeContext,
             status: str = "off",
             temperature: int = ROOM_TEMPERATURE,
             target_temperature: int = MIN_TEMPERATURE,
-            is_heating: bool = False,
             timer_enabled: bool = False,
             scheduled_on: time = DEFAULT_SCHEDULED_ON,
             scheduled_off: time = DEFAULT_SCHEDULED_OFF,
@@ -47,20 +109,24 @@ class WaterHeater(Device):
             device_type=DeviceType.WATER_HEATER,
             room=room,
             name=name,
-            mqtt_client=mqtt_client,
             status=status,
-            logger=logger,
-            sender_id=sender_id
+            context=context,
         )
-        self._temperature: int = temperature
         if MIN_TEMPERATURE <= target_temperature <= MAX_TEMPERATURE:
             self._target_temperature = target_temperature
         else:
             raise ValueError(f"Temperature must be between {MIN_TEMPERATURE} and {MAX_TEMPERATURE}")
-        self._is_heating: bool = is_heating
+        now = context.clock.now()
+        # Whether the heater is heating follows from its status and temperatures, so it isn't a parameter
+        self._temperature: int = temperature
+        self._anchor_temperature: float = share(SHARED_FLOATS, float(temperature))
+        self._anchor_time: float = now
+        self._settle()
         self._timer_enabled: bool = timer_enabled
-        self._scheduled_on: time = scheduled_on
-        self._scheduled_off: time = scheduled_off
+        self._scheduled_on: int = seconds_of_day(scheduled_on)
+        self._scheduled_off: int = seconds_of_day(scheduled_off)
+        self._next_on: float = next_occurrence(now, self._scheduled_on)
+        self._next_off: float = next_occurrence(now, self._scheduled_off)
 
     @staticmethod
     def fix_time_string(string: str) -> str:
@@ -71,9 +137,17 @@ class WaterHeater(Device):
         minutes = minutes.zfill(2)
         return f"{hours}:{minutes}"
 
+    @property
+    def status(self) -> str:
+        return self.STATUSES[self._status]
+
+    @status.setter
+    def status(self, value: str) -> None:
+        self._switch(self._status_index(value), self._context.clock.now())
+
     @property
     def temperature(self) -> int:
-        return self._temperature
+        return round(self._temperature_at(self._context.clock.now()))
 
     @property
     def target_temperature(self) -> int:
@@ -82,13 +156,19 @@ class WaterHeater(Device):
     @target_temperature.setter
     def target_temperature(self, value: int) -> None:
         if MIN_TEMPERATURE <= value <= MAX_TEMPERATURE:
+            self._anchor(self._context.clock.now())
             self._target_temperature = value
+            self._settle()
         else:
             raise ValueError(f"Temperature must be between {MIN_TEMPERATURE} and {MAX_TEMPERATURE}")
 
     @property
     def is_heating(self) -> bool:
-        return self._is_heating
+        return self._phase == Phase.HEATING
+
+    @property
+    def phase(self) -> Phase:
+        return Phase(self._phase)
 
     @property
     def timer_enabled(self) -> bool:
@@ -96,127 +176,182 @@ class WaterHeater(Device):
 
     @timer_enabled.setter
     def timer_enabled(self, value: bool) -> None:
+        if value and not self._timer_enabled:
+            now = self._context.clock.now()
+            self._next_on = next_occurrence(now, self._scheduled_on)
+            self._next_off = next_occurrence(now, self._scheduled_off)
         self._timer_enabled = value
 
     @property
     def scheduled_on(self) -> time:
-        return self._scheduled_on
+        return time_of_day(self._scheduled_on)
 
     @scheduled_on.setter
     def scheduled_on(self, value: time) -> None:
-        self._scheduled_on = value
+        self._scheduled_on = seconds_of_day(value)
+        self._next_on = next_occurrence(self._context.clock.now(), self._scheduled_on)
 
     @property
     def scheduled_off(self) -> time:
-        return self._scheduled_off
+        return time_of_day(self._scheduled_off)
 
     @scheduled_off.setter
     def scheduled_off(self, value: time) -> None:
-        self._scheduled_off = value
+        self._scheduled_off = seconds_of_day(value)
+        self._next_off = next_occurrence(self._context.clock.now(), self._scheduled_off)
+
+    def _floor_temperature(self) -> float:
+        # Where cooling stops
+        return float(self._target_temperature if self._status == 1 else ROOM_TEMPERATURE)
+
+    def _temperature_at(self, now: float) -> float:
+        match self._phase:
+            case Phase.HEATING:
+                return min(
+                    float(self._target_temperature),
+                    self._anchor_temperature + HEATING_RATE * (now - self._anchor_time),
+                )
+            case Phase.COOLING:
+                floor = self._floor_temperature()
+                if self._anchor_temperature <= floor:
+                    return self._anchor_temperature
+                return max(floor, self._anchor_temperature - HEATING_RATE * (now - self._anchor_time))
+            case _:
+                return self._anchor_temperature
+
+    def _phase_end(self) -> float:
+        """
+        Returns the time the current phase reaches its target, or infinity if it never changes on its own.
+        """
+        match self._phase:
+            case Phase.HEATING:
+                return self._anchor_time + (self._target_temperature - self._anchor_temperature) / HEATING_RATE
+            case Phase.COOLING:
+                floor = self._floor_temperature()
+                if self._anchor_temperature <= floor:
+                    return math.inf
+                return self._anchor_time + (self._anchor_temperature - floor) / HEATING_RATE
+            case _:
+                return math.inf
+
+    def _next_phase(self) -> int:
+        if self._status == 1 and self._anchor_temperature < self._target_temperature:
+            return Phase.HEATING
+        if self._status == 1 and self._anchor_temperature == self._target_temperature:
+            return Phase.HOLDING
+        return Phase.COOLING
+
+    def _settle(self) -> None:
+        self._phase = self._next_phase()
+        if self._phase_end() == math.inf:
+            # The temperature no longer depends on the anchor time
+            self._anchor_time = 0.0
+
+    def _anchor(self, now: float) -> None:
+        self._anchor_temperature = share(SHARED_FLOATS, self._temperature_at(now))
+        self._anchor_time = now
+
+    def _switch(self, status: int, now: float) -> None:
+        self._anchor(now)
+        self._status = status
+        self._settle()
+
+    SETTERS: dict[str, Setter] = {
+        **Device.SETTERS,
+        # Switching on and off also starts and stops heating
+        "status": (status.fset, None),
+        "target_temperature": (target_temperature.fset, None),
+        "timer_enabled": (timer_enabled.fset, None),
+        "scheduled_on": (scheduled_on.fset, parse_time),
+        "scheduled_off": (scheduled_off.fset, parse_time),
+    }
+
+    @override
+    def parameters(self) -> dict:
+        return {
+            "temperature": self.temperature,
+            "target_temperature": self.target_temperature,
+            "is_heating": self.is_heating,
+            "timer_enabled": self.timer_enabled,
+            "scheduled_on": self.scheduled_on.strftime("%H:%M"),
+            "scheduled_off": self.scheduled_off.strftime("%H:%M"),
+        }
 
     @override
-    def tick(self) -> None:
+    def advance(self, action_parameters: dict, update_parameters: dict) -> None:
         """
-        Actions to perform on every iteration of the main loop.
-        - Adjust temperature based on _is_heating
-        - Adjust status based on timer
-        - Adjust _is_heating based on status and target temperature
-        - Randomly apply change
-        - Publish changes to MQTT
+        - Switch status when a timer fires
+        - Start the next phase when the current one reaches its target
+        - Publish the temperature whenever it changes by a whole degree
         """
-        action_parameters = {}
-        update_parameters = {}
-        # Adjusting temperature
-        if self.is_heating:
-            self._temperature += HEATING_RATE
-            action_parameters['temperature'] = self.temperature
-        elif self._temperature > ROOM_TEMPERATURE:
-            self._temperature -= HEATING_RATE
-            action_parameters['temperature'] = self.temperature
-        # Adjusting status
-        if self.timer_enabled:
-            delta = timedelta(seconds=5)
-            now = datetime.now()
-            if (
-                    self.status == "off" and
-                    (now - delta <= datetime.combine(now.date(), self.scheduled_on) <= now + delta)
-            ):
-                update_parameters['status'] = self.status = "on"
-            elif (
-                    self.status == "on" and
-                    (now - delta <= datetime.combine(now.date(), self.scheduled_off) <= now + delta)
-            ):
-                update_parameters['status'] = self.status = "off"
-        # Adjusting is_heating
-        if self.is_heating:
-            self._logger.info("Is heating")
-            if self.temperature >= self.target_temperature or self.status == "off":
-                action_parameters["is_heating"] = self._is_heating = False
-        elif self.status == "on" and self.temperature < self.target_temperature:
-            action_parameters["is_heating"] = self._is_heating = True
-        # Random change
-        random.seed()
-        if random.random() < CHANCE_TO_CHANGE:
-            element_to_change = random.choice(
-                ['status', 'target_temperature', 'timer_enabled', 'scheduled_on', 'scheduled_off']
-            )
-            match element_to_change:
-                case 'status':
-                    update_parameters['status'] = self.status = 'on' if self.status == 'off' else 'off'
-                case 'target_temperature':
-                    next_temperature = self.target_temperature
-                    while next_temperature == self.target_temperature:
-                        next_temperature = random.randint(MIN_TEMPERATURE, MAX_TEMPERATURE)
-                    action_parameters['target_temperature'] = self.target_temperature = next_temperature
-                case 'timer_enabled':
-                    action_parameters['timer_enabled'] = self.timer_enabled = not self.timer_enabled
-                case 'scheduled_on':
-                    next_time = self.scheduled_on
-                    while next_time == self.scheduled_on:
-                        next_time = time(
-                            hour=random.randint(0, 23),
-                            minute=random.randint(0, 59),
-                        )
-                    self.scheduled_on = next_time
-                    action_parameters['scheduled_on'] = self.fix_time_string(
-                        str(self.scheduled_on.hour).zfill(2) + ':' + str(self.scheduled_on.minute).zfill(2))
-                case 'scheduled_off':
-                    next_time = self.scheduled_off
-                    while next_time == self.scheduled_off:
-                        next_time = time(
-                            hour=random.randint(0, 23),
-                            minute=random.randint(0, 59),
-                        )
-                    self.scheduled_off = next_time
-                    action_parameters['scheduled_off'] = self.fix_time_string(
-                        str(self.scheduled_off.hour).zfill(2) + ':' + str(self.scheduled_off.minute).zfill(2))
-                case _:
-                    print(f"Unknown element {element_to_change}")
-        # Publish changes
-        self.publish_mqtt(action_parameters, update_parameters)
+        now = self._context.clock.now()
+        was_heating = self.is_heating
+        if self._timer_enabled:
+            fired_on = now >= self._next_on
+            fired_off = now >= self._next_off
+            if fired_on:
+                self._next_on = share(
+                    SHARED_FLOATS,
+                    self._next_on + SECONDS_PER_DAY * (math.floor((now - self._next_on) / SECONDS_PER_DAY) + 1),
+                )
+            if fired_off:
+                self._next_off = share(
+                    SHARED_FLOATS,
+                    self._next_off + SECONDS_PER_DAY * (math.floor((now - self._next_off) / SECONDS_PER_DAY) + 1),
+                )
+            if self._status == 0 and fired_on:
+                self._switch(1, now)
+                update_parameters['status'] = self.status
+            elif self._status == 1 and fired_off:
+                self._switch(0, now)
+                update_parameters['status'] = self.status
+        if now >= self._phase_end():
+            self._anchor(now)
+            self._settle()
+        temperature = round(self._temperature_at(now))
+        if temperature != self._temperature:
+            action_parameters['temperature'] = self._temperature = temperature
+        if self.is_heating != was_heating:
+            action_parameters['is_heating'] = self.is_heating
+
+    @override
+    def is_active(self) -> bool:
+        return self._timer_enabled or self._phase_end() != math.inf
 
     @override
-    def update(self, new_values: dict) -> None:
-        for key, value in new_values.items():
-            if key in PARAMETERS + GENERAL_PARAMETERS:
-                try:
-                    match key:
-                        case "room":
-                            self.room = value
-                        case "name":
-                            self.name = value
-                        case "status":
-                            self.status = value
-                        case "target_temperature":
-                            self.target_temperature = value
-                        case "timer_enabled":
-                            self.timer_enabled = value
-                        case "scheduled_on":
-                            self.scheduled_on = time.fromisoformat(self.fix_time_string(value))
-                        case "scheduled_off":
-                            self.scheduled_off = time.fromisoformat(self.fix_time_string(value))
-                    self._logger.info(f"Setting parameter '{key}' to value '{value}'")
-                except ValueError:
-                    self._logger.exception(f"Incorrect value {value} for parameter {key}")
-            else:
-                raise ValueError(f"Incorrect parameter {key} for device type {self.type.value}")
+    def random_change(self, action_parameters: dict, update_parameters: dict) -> None:
+        element_to_change = self.choice(
+            ['status', 'target_temperature', 'timer_enabled', 'scheduled_on', 'scheduled_off']
+        )
+        match element_to_change:
+            case 'status':
+                update_parameters['status'] = self.status = 'on' if self.status == 'off' else 'off'
+            case 'target_temperature':
+                next_temperature = self.target_temperature
+                while next_temperature == self.target_temperature:
+                    next_temperature = self.randint(MIN_TEMPERATURE, MAX_TEMPERATURE)
+                action_parameters['target_temperature'] = self.target_temperature = next_temperature
+            case 'timer_enabled':
+                action_parameters['timer_enabled'] = self.timer_enabled = not self.timer_enabled
+            case 'scheduled_on':
+                next_time = self.scheduled_on
+                while next_time == self.scheduled_on:
+                    next_time = time(
+                        hour=self.randint(0, 23),
+                        minute=self.randint(0, 59),
+                    )
+                self.scheduled_on = next_time
+                action_parameters['scheduled_on'] = self.fix_time_string(
+                    str(self.scheduled_on.hour).zfill(2) + ':' + str(self.scheduled_on.minute).zfill(2))
+            case 'scheduled_off':
+                next_time = self.scheduled_off
+                while next_time == self.scheduled_off:
+                    next_time = time(
+                        hour=self.randint(0, 23),
+                        minute=self.randint(0, 59),
+                    )
+                self.scheduled_off = next_time
+                action_parameters['scheduled_off'] = self.fix_time_string(
+                    str(self.scheduled_off.hour).zfill(2) + ':' + str(self.scheduled_off.minute).zfill(2))
+            case _:
+                print(f"Unknown element {element_to_change}")